@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the scaling of ``wkr.groupby(..., workers=N)``.
+
+Groups synthetic records by two string keys, for several key
+cardinalities and worker counts, and prints the wall-clock time and
+speed-up relative to the single-process ``wkr.groupby``.
+
+Usage::
+
+    python benchmarks/bench_groupby_parallel.py [num_records] [max_workers]
+"""
+
+import multiprocessing
+import random
+import sys
+import timeit
+
+import wkr
+
+
+def make_records(num_records, cardinality):
+    """Build `num_records` dicts with two keys of the given cardinality."""
+    return [
+        {
+            "a": "a{}".format(random.randrange(cardinality)),
+            "b": "b{}".format(random.randrange(cardinality)),
+            "value": random.random(),
+        }
+        for _ in range(num_records)
+    ]
+
+
+def main():
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+    worker_counts = [n for n in [2, 4, 8, 16, 32] if n <= max_workers]
+    print(
+        "{:>12} {:>8} {:>8} {:>10} {:>8}".format(
+            "cardinality", "reducer", "workers", "seconds", "speed-up"
+        )
+    )
+    for cardinality in [10, 1000, 100000]:
+        records = make_records(num_records, cardinality)
+        for reducer in [None, "mean"]:
+            reducer_arg = None if reducer is None else wkr.Mean("value")
+            baseline = min(
+                timeit.repeat(
+                    lambda: wkr.groupby(records, "a", "b", reducer=reducer_arg),
+                    number=1,
+                    repeat=3,
+                )
+            )
+            print(
+                "{:>12} {:>8} {:>8} {:>10.3f} {:>8.2f}".format(
+                    cardinality, str(reducer), 1, baseline, 1.0
+                )
+            )
+            for workers in worker_counts:
+                elapsed = min(
+                    timeit.repeat(
+                        lambda: wkr.groupby(
+                            records,
+                            "a",
+                            "b",
+                            reducer=reducer_arg,
+                            workers=workers,
+                            chunk_size=50000,
+                        ),
+                        number=1,
+                        repeat=3,
+                    )
+                )
+                print(
+                    "{:>12} {:>8} {:>8} {:>10.3f} {:>8.2f}".format(
+                        cardinality, str(reducer), workers, elapsed, baseline / elapsed
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
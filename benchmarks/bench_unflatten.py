@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark ``wkr.pd.unflatten_dict`` against its former implementation.
+
+The former implementation (reproduced below) split every key on every
+call, built the result from ``AutoExpandingDict`` objects and then
+copied the whole tree again to turn integer-keyed dictionaries into
+lists.  Prints the time to unflatten the same records with both, for
+several record shapes.  The "varied" shape has records with random
+subsets of the keys, so that most key sets are seen only once.
+
+Usage::
+
+    python benchmarks/bench_unflatten.py [num_records]
+"""
+
+import collections
+import random
+import sys
+import timeit
+
+from wkr.pd import AutoExpandingDict, flatten_dict, unflatten_dict
+
+
+def _reference_intkeys_to_lists(dictionary):
+    if not isinstance(dictionary, collections.abc.MutableMapping):
+        return dictionary
+    result = {key: _reference_intkeys_to_lists(dictionary[key]) for key in dictionary}
+    if all(key.isdigit() for key in result.keys()) and set(result.keys()) == {
+        str(idx) for idx in range(len(result))
+    }:
+        return [result[str(idx)] for idx in range(len(result))]
+    else:
+        return result
+
+
+def reference_unflatten_dict(dictionary, separator=".", intkeys_to_lists=True):
+    """The former implementation of `wkr.pd.unflatten_dict`."""
+    result = AutoExpandingDict()
+    for key, value in dictionary.items():
+        path = key.split(separator)
+        ptr = result
+        for part in path[:-1]:
+            ptr = ptr[part]
+        ptr[path[-1]] = value
+    if intkeys_to_lists:
+        result = _reference_intkeys_to_lists(result)
+    return result
+
+
+def make_records(num_records, shape):
+    """Build `num_records` flattened dicts of the given shape."""
+    if shape == "flat":
+        records = [
+            {"field{}".format(field): idx for field in range(10)}
+            for idx in range(num_records)
+        ]
+    elif shape == "nested":
+        records = [
+            flatten_dict(
+                {
+                    "id": idx,
+                    "user": {"name": "u", "address": {"city": "c", "zip": idx}},
+                    "scores": {"a": 1.0, "b": 2.0},
+                }
+            )
+            for idx in range(num_records)
+        ]
+    elif shape == "lists":
+        records = [
+            flatten_dict(
+                {"id": idx, "tags": [{"k": tag, "v": idx} for tag in range(5)]}
+            )
+            for idx in range(num_records)
+        ]
+    else:
+        # 8 out of 40 keys in 8 groups, in random order
+        keys = ["group{}.field{}".format(idx // 5, idx % 5) for idx in range(40)]
+        records = [
+            {key: idx for key in random.sample(keys, 8)} for idx in range(num_records)
+        ]
+    return records
+
+
+def main():
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(
+        "{:>8} {:>12} {:>10} {:>8}".format("shape", "reference", "compiled", "speed-up")
+    )
+    for shape in ["flat", "nested", "lists", "varied"]:
+        records = make_records(num_records, shape)
+        assert [unflatten_dict(record) for record in records] == [
+            reference_unflatten_dict(record) for record in records
+        ]
+        reference = min(
+            timeit.repeat(
+                lambda: [reference_unflatten_dict(record) for record in records],
+                number=1,
+                repeat=3,
+            )
+        )
+        compiled = min(
+            timeit.repeat(
+                lambda: [unflatten_dict(record) for record in records],
+                number=1,
+                repeat=3,
+            )
+        )
+        print(
+            "{:>8} {:>12.3f} {:>10.3f} {:>8.2f}".format(
+                shape, reference, compiled, reference / compiled
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
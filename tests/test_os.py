@@ -6,11 +6,14 @@
 import os
 import random
 import string
+import threading
+import time
 
 import pytest
 
-from wkr.os import (backup_file, mkdir_p, momentary_chdir, open_atomic,
-                    temp_file_name, write_atomic)
+import wkr.os
+from wkr.os import (backup_file, file_lock, mkdir_p, momentary_chdir,
+                    open_atomic, temp_file_name, write_atomic)
 
 
 def test_mkdir_p_single(tmpdir):
@@ -198,3 +201,35 @@ def test_momentary_chdir_fail(tmpdir):
             # this is never executed
             assert False
     assert os.getcwd() == start_dir
+
+
+@pytest.mark.parametrize('use_fcntl', [True, False])
+def test_file_lock(tmpdir, monkeypatch, use_fcntl):
+    """Test that wkr.os.file_lock excludes concurrent holders."""
+    if not use_fcntl:
+        monkeypatch.setattr(wkr.os, 'fcntl', None)
+    elif wkr.os.fcntl is None:
+        pytest.skip('fcntl is not available')
+    path = tmpdir.join('test.lock').strpath
+    holders = []
+    overlaps = []
+
+    def worker():
+        with file_lock(path, poll_interval=0.001):
+            holders.append(None)
+            if len(holders) > 1:
+                overlaps.append(None)
+            time.sleep(0.01)
+            holders.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not overlaps
+    # the fallback removes its lock file on leaving
+    assert os.path.exists(path) == use_fcntl
+    with file_lock(path, remove=True):
+        assert os.path.exists(path)
+    assert not os.path.exists(path)
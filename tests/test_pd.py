@@ -3,10 +3,21 @@
 
 """Tests for `wkr.pd` package."""
 
+import json
+import os
+import random
+import threading
+import time
+
 import pandas as pd
 import pytest
 
-from wkr.pd import pandas_memoize_csv
+import wkr.pd
+from wkr.io import open_file
+from wkr.pd import (AutoExpandingDict, LazyFrame, compact, flatten_dict,
+                    flatten_records, frame_digest, pandas_memoize,
+                    pandas_memoize_csv, read_jsonl, unflatten_dataframe,
+                    unflatten_dict, unflatten_pd_row)
 
 
 def dataframe_gen():
@@ -109,3 +120,607 @@ def test_memoize_pandas_parse_dates(tmpdir):
 
     assert df2.equals(df)
     assert df2.index.dtype == df.index.dtype
+
+
+def typed_dataframe():
+    """Build a DataFrame with dtypes that CSV does not preserve."""
+    return pd.DataFrame(
+        {
+            "category": pd.Categorical(["a", "b", "a", "c"]),
+            "time": pd.date_range("1/1/2011", periods=4, freq="h"),
+            "count": pd.array([1, None, 3, 4], dtype="Int64"),
+            "value": [0.5, 1.5, 2.5, 3.5],
+        },
+        index=pd.Index(["w", "x", "y", "z"], name="key"),
+    )
+
+
+@pytest.mark.parametrize(
+    "fmt, filename",
+    [
+        ("parquet", "data.parquet"),
+        ("feather", "data.feather"),
+        ("pickle", "data.pkl"),
+        (None, "data.parquet"),
+        (None, "data.arrow"),
+        (None, "data.pkl.gz"),
+    ],
+)
+def test_pandas_memoize_formats(tmpdir, fmt, filename):
+    """Test that `wkr.pd.pandas_memoize` round-trips dtypes."""
+    filename = tmpdir.join(filename)
+    calls = []
+
+    @pandas_memoize(filename.strpath, format=fmt)
+    def f():
+        calls.append(None)
+        return typed_dataframe()
+
+    assert not filename.exists()
+    df = f()
+    assert filename.exists()
+    for memory_map in [False, True]:
+        df2 = pandas_memoize(filename.strpath, format=fmt, memory_map=memory_map)(f)()
+        pd.testing.assert_frame_equal(df2, df)
+    assert len(calls) == 1
+
+
+def test_pandas_memoize_legacy_csv(tmpdir):
+    """Test that `wkr.pd.pandas_memoize` reads caches written as CSV."""
+    filename = tmpdir.join("data.csv")
+    df = next(dataframe_gen())
+    df.to_csv(filename.strpath, encoding="utf-8")
+
+    @pandas_memoize(filename.strpath, format="parquet")
+    def f():
+        raise AssertionError("should not be called")
+
+    assert f().equals(df)
+    with pytest.raises(ValueError):
+        pandas_memoize(filename.strpath, format="hdf")
+
+
+def test_pandas_memoize_keyed(tmpdir):
+    """Test that `wkr.pd.pandas_memoize` caches per argument set."""
+    path = tmpdir.join("data-{key}.pkl").strpath
+    calls = []
+
+    @pandas_memoize(path)
+    def f(n, options=None):
+        calls.append(n)
+        return pd.DataFrame({"x": list(range(n))})
+
+    assert len(f(3)) == 3
+    assert len(f(4)) == 4
+    assert len(f(3)) == 3
+    assert calls == [3, 4]
+    assert len(tmpdir.listdir("*.pkl")) == 2
+    # dictionaries and sets are hashed independently of their order
+    f(2, options={"a": 1, "b": {1, 2}})
+    f(2, options={"b": {2, 1}, "a": 1})
+    assert calls == [3, 4, 2]
+    assert len(tmpdir.listdir("*.pkl")) == 3
+    # so are DataFrame arguments
+    g = pandas_memoize(tmpdir.join("double-{key}.pkl").strpath)(lambda df: df * 2)
+    df = pd.DataFrame({"x": [1, 2]})
+    assert g(df).equals(df * 2)
+    assert g(df * 2).equals(df * 4)
+    assert len(tmpdir.listdir("*.pkl")) == 5
+
+
+def test_pandas_memoize_invalidate(tmpdir):
+    """Test that `wkr.pd.pandas_memoize` drops caches of old versions."""
+    path = tmpdir.join("data-{key}.pkl").strpath
+    calls = []
+
+    def f(n):
+        calls.append(n)
+        return pd.DataFrame({"x": list(range(n))})
+
+    pandas_memoize(path, version=1)(f)(3)
+    pandas_memoize(path, version=1)(f)(4)
+    assert len(tmpdir.listdir("*.pkl")) == 2
+    pandas_memoize(path, version=1)(f)(3)
+    assert calls == [3, 4]
+    pandas_memoize(path, version=2)(f)(3)
+    assert calls == [3, 4, 3]
+    assert len(tmpdir.listdir("*.pkl")) == 1
+
+
+def test_pandas_memoize_max_size(tmpdir):
+    """Test that `wkr.pd.pandas_memoize` evicts least recently used files."""
+    path = tmpdir.join("data-{key}.pkl").strpath
+    calls = []
+
+    def f(n):
+        calls.append(n)
+        return pd.DataFrame({"x": [n] * 100})
+
+    g = pandas_memoize(path)(f)
+    g(1)
+    size = tmpdir.listdir("*.pkl")[0].size()
+    g = pandas_memoize(path, max_size=int(2.5 * size))(f)
+    g(2)
+    # backdate the files, so that reading 1 makes 2 the least recently used
+    for filename in tmpdir.listdir("*.pkl"):
+        os.utime(filename.strpath, (time.time() - 100, time.time() - 100))
+    g(1)
+    g(3)
+    assert calls == [1, 2, 3]
+    assert len(tmpdir.listdir("*.pkl")) == 2
+    g(1)
+    assert calls == [1, 2, 3]
+    g(2)
+    assert calls == [1, 2, 3, 2]
+
+
+def test_pandas_memoize_shared_directory(tmpdir):
+    """Test that keyed caches leave foreign files and each other alone."""
+    path = tmpdir.join("{key}.pkl").strpath
+    foreign = tmpdir.join("important_results.pkl")
+    pd.DataFrame({"x": [1]}).to_pickle(foreign.strpath)
+    calls = []
+
+    def f(n):
+        calls.append(("f", n))
+        return pd.DataFrame({"x": [n] * 100})
+
+    def g(n):
+        calls.append(("g", n))
+        return pd.DataFrame({"y": [n] * 100})
+
+    for version in [1, 2]:
+        for n in [1, 2]:
+            pandas_memoize(path, version=version, max_size=1)(f)(n)
+            pandas_memoize(path, version=version)(g)(n)
+            pandas_memoize(path, version=version)(g)(n)
+    assert calls == [
+        (name, n) for _version in [1, 2] for n in [1, 2] for name in "fg"
+    ]
+    assert foreign.exists()
+    # f keeps only its latest file, and g keeps both of its version 2
+    assert len(tmpdir.listdir("*.pkl")) == 4
+
+
+def test_pandas_memoize_concurrent(tmpdir):
+    """Test that `wkr.pd.pandas_memoize` computes once for many callers."""
+    filename = tmpdir.join("data.csv.gz")
+    calls = []
+
+    @pandas_memoize(filename.strpath)
+    def f():
+        calls.append(None)
+        time.sleep(0.05)
+        return next(dataframe_gen())
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(f())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(results) == 8
+    assert not tmpdir.listdir("*.lock")
+    for df in results:
+        assert df.equals(next(dataframe_gen()))
+    # the cache is compressed according to its extension
+    assert pd.read_csv(filename.strpath, index_col=0).equals(next(dataframe_gen()))
+    assert filename.read_binary()[:2] == b"\x1f\x8b"
+
+
+@pytest.mark.parametrize(
+    "filename", ["data.parquet", "data.feather", "data.pkl", "data.csv"]
+)
+def test_pandas_memoize_lazy(tmpdir, filename):
+    """Test the `LazyFrame` returned by `wkr.pd.pandas_memoize`."""
+    filename = tmpdir.join(filename)
+    calls = []
+
+    @pandas_memoize(filename.strpath, lazy=True)
+    def f():
+        calls.append(None)
+        return typed_dataframe()
+
+    for _ in range(2):
+        frame = f()
+        assert isinstance(frame, LazyFrame)
+        assert frame.columns == ["category", "time", "count", "value"]
+    assert len(calls) == 1
+
+    df = frame.load(columns=["value"])
+    assert df.columns.tolist() == ["value"]
+    assert df.index.tolist() == ["w", "x", "y", "z"]
+    df = frame.load(columns=["value"], filters=[("count", ">=", 3)])
+    assert df["value"].tolist() == [2.5, 3.5]
+    df = frame.load(filters=[[("value", "<", 1)], [("value", ">", 3)]])
+    assert df.index.tolist() == ["w", "z"]
+    assert len(df.columns) == 4
+
+    chunks = list(frame.iter_chunks(3, columns=["value"]))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    assert pd.concat(chunks)["value"].tolist() == [0.5, 1.5, 2.5, 3.5]
+    assert pd.concat(chunks).index.tolist() == ["w", "x", "y", "z"]
+    chunks = frame.iter_chunks(2, columns=["value"], filters=[("value", ">", 1)])
+    assert pd.concat(chunks)["value"].tolist() == [1.5, 2.5, 3.5]
+
+
+@pytest.mark.parametrize(
+    "filename", ["data.parquet", "data.feather", "data.pkl", "data.csv"]
+)
+def test_pandas_memoize_lazy_range_index(tmpdir, filename):
+    """Test that a `LazyFrame` keeps a default `RangeIndex`."""
+
+    @pandas_memoize(tmpdir.join(filename).strpath, lazy=True)
+    def f():
+        return pd.DataFrame({"value": [float(idx) for idx in range(10)]})
+
+    frame = f()
+    assert frame.columns == ["value"]
+    chunks = list(frame.iter_chunks(4))
+    assert [chunk.index.tolist() for chunk in chunks] == [
+        [0, 1, 2, 3],
+        [4, 5, 6, 7],
+        [8, 9],
+    ]
+    df = frame.load(filters=[("value", ">=", 7)])
+    assert df.index.tolist() == [7, 8, 9]
+    chunks = frame.iter_chunks(4, columns=["value"], filters=[("value", ">", 5)])
+    assert pd.concat(chunks).index.tolist() == [6, 7, 8, 9]
+
+
+def nested_records():
+    """Generate nested dictionaries with varying structures."""
+    for idx in range(25):
+        record = {"id": idx, "user": {"name": "u{}".format(idx % 3)}}
+        if idx % 2:
+            record["tags"] = ["t{}".format(tag) for tag in range(idx % 4)]
+        if idx % 5 == 0:
+            record["user"]["address"] = {"city": "c", "zip": str(idx)}
+        if idx == 20:
+            record["late"] = {"empty": {}}
+        yield record
+
+
+def test_flatten_records():
+    """Test that `wkr.pd.flatten_records` matches `flatten_dict`."""
+    expected = pd.DataFrame([flatten_dict(record) for record in nested_records()])
+    expected = expected.astype(object).where(expected.notna(), None)
+    columns = flatten_records(nested_records())
+    assert list(columns) == list(expected.columns)
+    assert columns == expected.to_dict(orient="list")
+    df = flatten_records(nested_records(), output="pandas")
+    pd.testing.assert_frame_equal(df.astype(object).where(df.notna(), None), expected)
+    table = flatten_records(nested_records(), output="arrow")
+    assert table.column_names == list(expected.columns)
+    assert table.num_rows == 25
+    assert list(flatten_records([], output="dict")) == []
+    assert flatten_records([{"a": {"b": [1, {"c": 2}]}}], separator="/") == {
+        "a/b/0": [1],
+        "a/b/1/c": [2],
+    }
+    for record in nested_records():
+        columns = flatten_records([record], separator="/")
+        flat = flatten_dict(record, separator="/")
+        assert {key: values[0] for key, values in columns.items()} == flat
+
+
+def test_flatten_records_chunks():
+    """Test `wkr.pd.flatten_records` with a chunk size."""
+    chunks = list(flatten_records(nested_records(), chunksize=10, output="pandas"))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    # the columns only grow from chunk to chunk
+    for chunk, next_chunk in zip(chunks, chunks[1:]):
+        assert list(next_chunk.columns)[: len(chunk.columns)] == list(chunk.columns)
+    assert "late.empty" not in chunks[-1].columns
+    df = pd.concat(chunks)
+    assert df.index.tolist() == list(range(25))
+    expected = flatten_records(nested_records(), output="pandas")
+    pd.testing.assert_frame_equal(df[expected.columns], expected, check_dtype=False)
+    assert list(flatten_records(iter([]), chunksize=10)) == []
+    assert len(list(flatten_records(nested_records(), chunksize=5))) == 5
+
+
+def test_unflatten_dataframe():
+    """Test that `wkr.pd.unflatten_dataframe` matches `unflatten_pd_row`."""
+    df = flatten_records(nested_records(), output="pandas")
+    df["user.tags.0"] = "x"
+    for prefix in ["", "user", "user.address", "tags", "missing"]:
+        for intkeys_to_lists in [True, False]:
+            expected = [
+                unflatten_pd_row(row, prefix=prefix, intkeys_to_lists=intkeys_to_lists)
+                for _idx, row in df.iterrows()
+            ]
+            records = unflatten_dataframe(
+                df, prefix=prefix, intkeys_to_lists=intkeys_to_lists
+            )
+            assert records == expected
+    records = unflatten_dataframe(df, prefix="user")
+    assert records[0] == {
+        "name": "u0",
+        "address": {"city": "c", "zip": "0"},
+        "tags": ["x"],
+    }
+    assert unflatten_dataframe(df, prefix="id") == list(range(25))
+
+
+def test_unflatten_dataframe_iterator(monkeypatch):
+    """Test `wkr.pd.unflatten_dataframe` in generator mode."""
+    monkeypatch.setattr(wkr.pd, "_UNFLATTEN_CHUNK_SIZE", 7)
+    df = flatten_records(nested_records(), separator="/", output="pandas")
+    records = unflatten_dataframe(df, separator="/", iterator=True)
+    assert not isinstance(records, list)
+    assert list(records) == unflatten_dataframe(df, separator="/")
+    assert next(unflatten_dataframe(df[[]], iterator=True)) == []
+    with pytest.raises(TypeError):
+        unflatten_dataframe(pd.DataFrame({"a": [1], "a.b": [2]}))
+
+
+def test_unflatten_dataframe_deep():
+    """Test `wkr.pd.unflatten_dataframe` on deeply nested columns."""
+    column = ".".join(["k"] * 3000)
+    df = pd.DataFrame({column: [1, 2], column[:-2] + ".0": [3, 4]})
+    for record, value in zip(unflatten_dataframe(df), [1, 2]):
+        for _ in range(2999):
+            record = record["k"]
+        assert record == {"k": value, "0": value + 2}
+
+
+def test_unflatten_dataframe_unordered():
+    """Test `wkr.pd.unflatten_dataframe` with list indices out of order."""
+    df = pd.DataFrame([flatten_dict({"x": [{"v": v} for v in range(12)]})])
+    df = df.sort_index(axis=1)
+    expected = {"x": [{"v": v} for v in range(12)]}
+    assert unflatten_dataframe(df) == [expected]
+    assert unflatten_pd_row(df.iloc[0]) == expected
+    df = pd.DataFrame({"x.1.a": [1], "x.0.b": [2]})
+    assert unflatten_dataframe(df) == [{"x": [{"b": 2}, {"a": 1}]}]
+
+
+def test_unflatten_dict(monkeypatch):
+    """Test that `wkr.pd.unflatten_dict` inverts `flatten_dict`."""
+    monkeypatch.setattr(wkr.pd, "_UNFLATTEN_BUILDERS", {})
+    # the first call unflattens directly, later ones compile the keys
+    for _ in range(3):
+        for record in nested_records():
+            record.pop("late", None)
+            assert unflatten_dict(flatten_dict(record)) == record
+        flat = {"a.0": 1, "a.1.b": 2, "c.1": 3, "c.2": 4}
+        expected = {"a": [1, {"b": 2}], "c": {"1": 3, "2": 4}}
+        assert unflatten_dict(flat) == expected
+        assert unflatten_dict({"0": "x", "1": "y"}) == ["x", "y"]
+        assert unflatten_dict({}) == []
+        assert unflatten_dict({"a": {"b": 1}}) == {"a": {"b": 1}}
+        nested = unflatten_dict(flat, intkeys_to_lists=False)
+        assert isinstance(nested, AutoExpandingDict)
+        assert isinstance(nested["a"], AutoExpandingDict)
+        assert nested["a"]["1"] == {"b": 2}
+        assert unflatten_dict({"a/b": 1}, separator="/") == {"a": {"b": 1}}
+        for conflicting in [{"a": 1, "a.b": 2}, {"a.b": 1, "a": 2}]:
+            with pytest.raises(TypeError):
+                unflatten_dict(conflicting)
+        deep = unflatten_dict({".".join(["k"] * 3000): 1})
+        for _ in range(3000):
+            deep = deep["k"]
+        assert deep == 1
+
+
+def test_unflatten_dict_unordered(monkeypatch):
+    """Test `wkr.pd.unflatten_dict` with list indices out of order."""
+    monkeypatch.setattr(wkr.pd, "_UNFLATTEN_BUILDERS", {})
+    rng = random.Random(0)
+    records = [{"x": [{"a": 1}, {"b": 2}], "y": [[1, 2], {"c": [3]}]}]
+    records.append({"x": [{"v": v} for v in range(12)]})
+    records.extend(nested_records())
+    for record in records:
+        record.pop("late", None)
+        items = list(flatten_dict(record).items())
+        for _ in range(5):
+            rng.shuffle(items)
+            flat = dict(items)
+            plain = wkr.pd._unflatten_plain(flat, ".", True)
+            # the first call unflattens directly, the second compiles
+            assert plain == record
+            assert unflatten_dict(flat) == record
+            assert unflatten_dict(flat) == record
+    flat = {"x.1.a": 1, "x.0.b": 2}
+    for _ in range(3):
+        assert unflatten_dict(flat) == {"x": [{"b": 2}, {"a": 1}]}
+
+
+def test_unflatten_dict_cache(monkeypatch):
+    """Test that `wkr.pd.unflatten_dict` only caches recent key sets."""
+    monkeypatch.setattr(wkr.pd, "_UNFLATTEN_BUILDERS", {})
+    monkeypatch.setattr(wkr.pd, "_UNFLATTEN_CACHE_SIZE", 4)
+    for idx in range(10):
+        unflatten_dict({"a.{}".format(idx): idx})
+    assert len(wkr.pd._UNFLATTEN_BUILDERS) == 4
+    assert set(wkr.pd._UNFLATTEN_BUILDERS.values()) == {None}
+    unflatten_dict({"a.9": 1})
+    assert wkr.pd._UNFLATTEN_BUILDERS[(("a.9",), ".", True)] is not None
+
+
+@pytest.mark.parametrize("filename", ["data.jsonl", "data.jsonl.gz"])
+def test_read_jsonl(tmpdir, filename):
+    """Test `wkr.pd.read_jsonl`."""
+    filename = tmpdir.join(filename).strpath
+    records = list(nested_records())
+    with open_file(filename, "wt") as output_file:
+        for idx, record in enumerate(records):
+            output_file.write(json.dumps(record) + "\n")
+            if idx == 3:
+                output_file.write("\n")
+
+    expected = flatten_records(records, output="pandas")
+    pd.testing.assert_frame_equal(read_jsonl(filename), expected)
+    for workers in [None, 2]:
+        chunks = list(read_jsonl(filename, chunksize=10, workers=workers))
+        # chunks are made of lines, and the fifth line is blank
+        assert [len(chunk) for chunk in chunks] == [9, 10, 6]
+        for chunk, next_chunk in zip(chunks, chunks[1:]):
+            assert list(next_chunk.columns)[: len(chunk.columns)] == list(chunk.columns)
+        df = pd.concat(chunks)
+        assert df.index.tolist() == list(range(25))
+        pd.testing.assert_frame_equal(df[expected.columns], expected, check_dtype=False)
+
+    df = read_jsonl(filename, flatten=False)
+    assert df.columns.tolist()[:3] == ["id", "user", "tags"]
+    assert df["user"][0] == {"name": "u0", "address": {"city": "c", "zip": "0"}}
+    df = read_jsonl(filename, separator="/")
+    assert "user/address/city" in df.columns
+    assert "tags/0" in df.columns
+    columns = {
+        key for record in records for key in flatten_dict(record, separator="/")
+    }
+    assert set(df.columns) == columns
+
+
+def test_compact():
+    """Test that `wkr.pd.compact` downcasts without losing values."""
+    df = pd.DataFrame(
+        {
+            "small": list(range(100)),
+            "negative": [-idx for idx in range(100)],
+            "large": [idx * 10**10 for idx in range(100)],
+            "half": [idx / 2 for idx in range(100)],
+            "third": [idx / 3 for idx in range(100)],
+            "label": ["a", "b", "c", None] * 25,
+            "name": ["n{}".format(idx) for idx in range(100)],
+            "flag": [True, False] * 50,
+            "nested": [{"a": 1}] * 100,
+        }
+    )
+    result, savings = compact(df, return_savings=True)
+    assert result["small"].dtype == "int8"
+    assert result["negative"].dtype == "int8"
+    assert result["large"].dtype == "int64"
+    assert result["half"].dtype == "float32"
+    assert result["third"].dtype == "float64"
+    assert isinstance(result["label"].dtype, pd.CategoricalDtype)
+    assert not isinstance(result["name"].dtype, pd.CategoricalDtype)
+    assert result["flag"].dtype == bool
+    assert result["nested"].dtype == object
+    assert savings == (
+        df.memory_usage(deep=True).sum() - result.memory_usage(deep=True).sum()
+    )
+    assert savings > 0
+    pd.testing.assert_frame_equal(result, compact(df))
+    for column in df.columns:
+        assert result[column].tolist() == df[column].where(df[column].notna()).tolist()
+    # arithmetic on downcast columns does not wrap around
+    assert (result["small"] - 2).tolist()[:3] == [-2, -1, 0]
+    # the input is not modified
+    assert df["small"].dtype == "int64"
+    # columns of only missing values are left alone
+    missing = pd.DataFrame({"a": pd.array([None, None], dtype="Int64")})
+    assert compact(missing)["a"].dtype == "Int64"
+    nullable = pd.DataFrame({"a": pd.array([1, None, 3], dtype="Int64")})
+    assert compact(nullable)["a"].dtype == "Int8"
+    nullable = pd.DataFrame({"a": pd.array([0.5, None, 3.0], dtype="Float64")})
+    result = compact(nullable)
+    assert result["a"].dtype == "Float32"
+    assert result["a"].isna().tolist() == [False, True, False]
+    assert result["a"][1] is pd.NA
+    nullable = pd.DataFrame({"a": pd.array([0.1, None], dtype="Float64")})
+    assert compact(nullable)["a"].dtype == "Float64"
+    assert isinstance(
+        compact(df, categorical_threshold=1.0)["name"].dtype, pd.CategoricalDtype
+    )
+
+
+def test_pandas_memoize_optimize_dtypes(tmpdir):
+    """Test `wkr.pd.pandas_memoize` with `optimize_dtypes`."""
+    filename = tmpdir.join("data.csv")
+
+    @pandas_memoize(filename.strpath, optimize_dtypes=True)
+    def f():
+        return pd.DataFrame({"count": [1, 2, 3, 4], "label": ["a", "a", "b", "b"]})
+
+    for _ in range(2):
+        df = f()
+        assert df["count"].dtype == "int8"
+        assert isinstance(df["label"].dtype, pd.CategoricalDtype)
+
+
+def test_frame_digest():
+    """Test that `wkr.pd.frame_digest` tells frames apart."""
+    df = typed_dataframe()
+    digest = frame_digest(df)
+    assert frame_digest(typed_dataframe()) == digest
+    assert len({frame_digest(obj) for obj in [df, df["value"], df.index]}) == 3
+    changed = [
+        df.assign(value=df["value"] + 1),
+        df.rename(columns={"value": "other"}),
+        df.astype({"value": "float32"}),
+        df.set_axis(["w", "x", "y", "a"]),
+        df.iloc[:3],
+        df[["time", "category", "count", "value"]],
+    ]
+    for other in changed:
+        assert frame_digest(other) != digest
+    # categoricals with the same values but other categories or order
+    category = df["category"]
+    categoricals = [
+        df,
+        df.assign(category=category.cat.add_categories(["d"])),
+        df.assign(category=category.cat.reorder_categories(["c", "b", "a"])),
+        df.assign(category=category.cat.as_ordered()),
+        df.assign(
+            category=category.cat.reorder_categories(["c", "b", "a"])
+            .cat.as_ordered()
+        ),
+    ]
+    assert len({frame_digest(other) for other in categoricals}) == 5
+    objects = pd.DataFrame({"a": [{"x": 1}, {"y": 2}]})
+    assert frame_digest(objects) == frame_digest(objects.copy())
+    assert frame_digest(objects) != frame_digest(objects.iloc[::-1])
+
+    big = pd.DataFrame({"x": range(1000)})
+    sampled = frame_digest(big, sample=10)
+    assert sampled != frame_digest(big)
+    assert frame_digest(big.assign(x=big["x"].replace(1, -1)), sample=10) == sampled
+    assert frame_digest(big.assign(x=big["x"].replace(0, -1)), sample=10) != sampled
+    assert frame_digest(df, sample=10) == digest
+
+
+def test_pandas_memoize_frame_arguments(tmpdir):
+    """Test that `wkr.pd.pandas_memoize` keys on DataFrame contents."""
+    calls = []
+
+    @pandas_memoize(tmpdir.join("data-{key}.pkl").strpath)
+    def f(df):
+        calls.append(None)
+        return df * 2
+
+    df = pd.DataFrame({"x": [1, 2]})
+    f(df)
+    f(df.copy())
+    assert len(calls) == 1
+    f(df + 1)
+    f(df.rename(columns={"x": "y"}))
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("filename", ["data.csv", "data.parquet", "data-{key}.pkl"])
+def test_pandas_memoize_no_lock_files(tmpdir, filename):
+    """Test that `wkr.pd.pandas_memoize` does not leave lock files."""
+    f = pandas_memoize(tmpdir.join(filename).strpath)(lambda: typed_dataframe())
+    f()
+    f()
+    assert len(tmpdir.listdir()) == 1
+
+
+def test_read_jsonl_line_boundaries(tmpdir):
+    """Test that `wkr.pd.read_jsonl` only splits lines at newlines."""
+    filename = tmpdir.join("data.jsonl")
+    # JSON escapes control characters, but not these line boundaries
+    texts = ["a\u2028b", "c\u0085d", "e\u2029f"]
+    with open(filename.strpath, "wb") as output_file:
+        for text in texts:
+            line = json.dumps({"text": text}, ensure_ascii=False)
+            output_file.write(line.encode("utf-8") + b"\n")
+    for chunksize in [None, 2]:
+        df = read_jsonl(filename.strpath, chunksize=chunksize)
+        if chunksize is not None:
+            df = pd.concat(df)
+        assert df["text"].tolist() == texts
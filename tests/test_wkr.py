@@ -5,12 +5,15 @@
 
 import itertools
 import json
+import pickle
 import random
+import statistics
 import string
 import timeit
 from collections import Counter
 from functools import reduce
 
+import numpy as np
 import pytest
 import scipy.stats
 
@@ -177,6 +180,73 @@ def test_rle():
     assert list(wkr.rle("aaAAaa", keyfunc=lambda x: x.lower())) == [("a", 0, 6)]
 
 
+def test_rle_keyfunc_calls():
+    """Test that wkr.rle calls keyfunc once per element."""
+    calls = []
+
+    def keyfunc(x):
+        calls.append(x)
+        return x.lower()
+
+    assert list(wkr.rle("aaAAbbBa", keyfunc=keyfunc)) == [
+        ("a", 0, 4),
+        ("b", 4, 7),
+        ("a", 7, 8),
+    ]
+    assert len(calls) == 8
+
+
+def test_rle_array():
+    """Test the vectorized wkr.rle_array method."""
+    values = [1, 1, 1, 1, 0, 0, 0, 1, 1, 1, 1, 1, 1, 0, 0, 1]
+    symbols, begins, ends = wkr.rle_array(np.array(values))
+    assert symbols.tolist() == [1, 0, 1, 0, 1]
+    assert begins.tolist() == [0, 4, 7, 13, 15]
+    assert ends.tolist() == [4, 7, 13, 15, 16]
+    # rle dispatches to rle_array for arrays
+    assert list(wkr.rle(np.array(values))) == list(wkr.rle(values))
+    assert list(wkr.rle(np.array([]))) == []
+    assert list(wkr.rle(np.array(list("aaAAaa")))) == list(wkr.rle("aaAAaa"))
+    # rows of 2-D arrays are symbols
+    symbols, begins, ends = wkr.rle_array(np.array([[0, 1], [0, 1], [1, 1]]))
+    assert symbols.tolist() == [[0, 1], [1, 1]]
+    assert begins.tolist() == [0, 2]
+    assert ends.tolist() == [2, 3]
+
+
+def test_rle_decode():
+    """Test that wkr.rle_decode inverts wkr.rle."""
+    for _ in range(20):
+        values = [random.randint(0, 2) for _ in range(random.randint(0, 50))]
+        assert wkr.rle_decode(wkr.rle(values)) == values
+        arr = np.array(values, dtype=int)
+        decoded = wkr.rle_decode(wkr.rle_array(arr))
+        assert isinstance(decoded, np.ndarray)
+        assert decoded.tolist() == values
+    assert wkr.rle_decode(wkr.rle("aaAAbb", keyfunc=lambda x: x.lower())) == list(
+        "aaaabb"
+    )
+
+
+def test_rle_encoder():
+    """Test that wkr.RLEEncoder merges runs across chunk boundaries."""
+    for _ in range(20):
+        values = [random.randint(0, 2) for _ in range(random.randint(0, 80))]
+        expected = list(wkr.rle(values))
+        for size in [1, 3, 7, 100]:
+            chunks = wkr.chunks(values, size)
+            assert list(wkr.RLEEncoder.encode_chunks(chunks)) == expected
+            arrays = (np.array(chunk) for chunk in wkr.chunks(values, size))
+            assert list(wkr.RLEEncoder.encode_chunks(arrays)) == expected
+    encoder = wkr.RLEEncoder(keyfunc=lambda x: x.lower())
+    assert encoder.encode("aaA") == []
+    assert encoder.encode("Abb") == [("a", 0, 4)]
+    assert encoder.encode("") == []
+    assert encoder.encode("BBa") == [("b", 4, 8)]
+    assert encoder.flush() == [("a", 8, 9)]
+    assert encoder.flush() == []
+
+
 def test_first():
     assert wkr.first(lambda x: x > 10, range(20)) == 11
     with pytest.raises(StopIteration):
@@ -201,6 +271,76 @@ def test_chunks():
     assert list(wkr.chunks(range(10), 4)) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
     with pytest.raises(ValueError):
         list(wkr.chunks(range(10), 0))
+    with pytest.raises(ValueError):
+        list(wkr.chunks(range(10), 3, drop_last=True, pad=0))
+    assert list(wkr.chunks(list(range(10)), 4)) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert list(wkr.chunks(range(10), 4, drop_last=True)) == [
+        [0, 1, 2, 3],
+        [4, 5, 6, 7],
+    ]
+    assert list(wkr.chunks(list(range(10)), 4, pad=-1)) == [
+        [0, 1, 2, 3],
+        [4, 5, 6, 7],
+        [8, 9, -1, -1],
+    ]
+
+
+def test_chunks_array():
+    """Test that wkr.chunks yields views of NumPy arrays."""
+    arr = np.arange(20).reshape(10, 2)
+    batches = list(wkr.chunks(arr, 4))
+    assert [batch.shape for batch in batches] == [(4, 2), (4, 2), (2, 2)]
+    assert all(np.shares_memory(batch, arr) for batch in batches)
+    assert np.array_equal(np.concatenate(batches), arr)
+    batches = list(wkr.chunks(arr, 4, pad=0))
+    assert batches[-1].tolist() == [[16, 17], [18, 19], [0, 0], [0, 0]]
+    assert len(list(wkr.chunks(arr, 4, drop_last=True))) == 2
+    # collation stacks items into arrays
+    batches = list(wkr.chunks(iter([(1, 2), (3, 4), (5, 6)]), 2, collate=True))
+    assert [batch.tolist() for batch in batches] == [[[1, 2], [3, 4]], [[5, 6]]]
+    assert list(wkr.chunks(range(5), 2, collate=sum)) == [1, 5, 4]
+
+
+def test_parallel_map():
+    """Test wkr.parallel_map with both backends."""
+    values = list(range(-500, 500))
+    expected = [abs(x) for x in values]
+    for backend in ["thread", "process"]:
+        for chunk_size in ["auto", 1, 7]:
+            results = wkr.parallel_map(
+                abs, values, workers=3, chunk_size=chunk_size, backend=backend
+            )
+            assert list(results) == expected
+        results = wkr.parallel_map(abs, iter(values), workers=3, ordered=False)
+        assert sorted(results) == sorted(expected)
+    assert list(wkr.parallel_map(abs, [], workers=2)) == []
+    with pytest.raises(ValueError):
+        list(wkr.parallel_map(abs, values, backend="fork"))
+
+
+def test_parallel_map_exception():
+    """Test that wkr.parallel_map propagates exceptions from workers."""
+
+    def invert(x):
+        return 1 / x
+
+    with pytest.raises(ZeroDivisionError):
+        list(wkr.parallel_map(invert, range(-50, 50), workers=2, chunk_size=3))
+
+
+def test_parallel_map_prefetch():
+    """Test that wkr.parallel_map consumes its input lazily."""
+    consumed = []
+
+    def source():
+        for item in range(1000):
+            consumed.append(item)
+            yield item
+
+    results = wkr.parallel_map(abs, source(), workers=2, chunk_size=10, prefetch=2)
+    assert next(results) == 0
+    assert len(consumed) <= 30
+    results.close()
 
 
 def test_pairwise():
@@ -208,6 +348,67 @@ def test_pairwise():
     assert list(wkr.pairwise(range(5))) == [(0, 1), (1, 2), (2, 3), (3, 4)]
 
 
+def reference_windows(values, n, step, fill=None, use_fill=False):
+    """Compute sliding windows by slicing, for comparison."""
+    windows = []
+    for start in range(0, max(len(values), 1), step):
+        window = tuple(values[start : start + n])
+        if len(window) == n:
+            windows.append(window)
+        elif use_fill and window and (start == 0 or start - step + n < len(values)):
+            windows.append(window + (fill,) * (n - len(window)))
+            break
+    return windows
+
+
+def test_windowed():
+    """Test wkr.windowed against a slicing implementation."""
+    with pytest.raises(ValueError):
+        list(wkr.windowed(range(5), 0))
+    with pytest.raises(ValueError):
+        list(wkr.windowed(range(5), 2, step=0))
+    assert list(wkr.windowed(range(5), 2)) == list(wkr.pairwise(range(5)))
+    assert list(wkr.windowed(range(5), 3, fill=None)) == [
+        (0, 1, 2),
+        (1, 2, 3),
+        (2, 3, 4),
+    ]
+    assert list(wkr.windowed(range(5), 3, step=2, fill=None)) == [
+        (0, 1, 2),
+        (2, 3, 4),
+    ]
+    assert list(wkr.windowed(range(6), 3, step=2, fill=None)) == [
+        (0, 1, 2),
+        (2, 3, 4),
+        (4, 5, None),
+    ]
+    assert list(wkr.windowed(range(2), 3, fill=0)) == [(0, 1, 0)]
+    for length, n, step in itertools.product(range(12), range(1, 5), range(1, 7)):
+        values = list(range(length))
+        assert list(wkr.windowed(iter(values), n, step)) == reference_windows(
+            values, n, step
+        )
+        assert list(wkr.windowed(values, n, step, fill=-1)) == reference_windows(
+            values, n, step, -1, True
+        )
+        arr = np.array(values)
+        assert [tuple(w) for w in wkr.windowed(arr, n, step)] == reference_windows(
+            values, n, step
+        )
+        assert [
+            tuple(w) for w in wkr.windowed(arr, n, step, fill=-1)
+        ] == reference_windows(values, n, step, -1, True)
+
+
+def test_windowed_array_view():
+    """Test that wkr.windowed returns views of NumPy arrays."""
+    arr = np.arange(12).reshape(6, 2)
+    windows = wkr.windowed(arr, 3)
+    assert windows.shape == (4, 3, 2)
+    assert np.shares_memory(windows, arr)
+    assert windows[1].tolist() == [[2, 3], [4, 5], [6, 7]]
+
+
 def test_groupby():
     # must supply a key function to groupby
     with pytest.raises(TypeError):
@@ -245,6 +446,227 @@ def test_groupby():
     }
 
 
+def test_groupby_flat():
+    """Test wkr.groupby with flat=True and wkr.nest_groups."""
+    records = [
+        {"type": "A", "color": "red", "value": 1},
+        {"type": "B", "color": "red", "value": 2},
+        {"type": "A", "color": "blue", "value": 3},
+        {"type": "A", "color": "red", "value": 4},
+    ]
+    flat = wkr.groupby(records, "type", "color", flat=True)
+    assert dict(flat) == {
+        ("A", "red"): [records[0], records[3]],
+        ("B", "red"): [records[1]],
+        ("A", "blue"): [records[2]],
+    }
+    nested = wkr.groupby(records, "type", "color")
+    assert wkr.nest_groups(flat, 2, list) == nested
+    assert wkr.nest_groups(flat, 2) == nested
+    # the nested result keeps the defaultdict behaviour
+    assert nested["C"]["green"] == []
+    # mixed string and function keys
+    flat = wkr.groupby(records, "type", lambda r: r["value"] % 2, flat=True)
+    assert sorted(flat) == [("A", 0), ("A", 1), ("B", 0)]
+    # single keys are not wrapped in tuples
+    flat = wkr.groupby(range(6), lambda x: x % 2, container=set, flat=True)
+    assert dict(flat) == {0: {0, 2, 4}, 1: {1, 3, 5}}
+    assert wkr.nest_groups(flat, 1) == {0: {0, 2, 4}, 1: {1, 3, 5}}
+
+
+def test_groupby_reducer():
+    """Test wkr.groupby with streaming reducers."""
+    values = [random.randint(0, 1000) for _ in range(500)]
+    groups = wkr.groupby(values, lambda x: x % 3)
+    assert wkr.groupby(values, lambda x: x % 3, reducer="count") == {
+        key: len(group) for key, group in groups.items()
+    }
+    for name, func in [
+        ("sum", sum),
+        ("min", min),
+        ("max", max),
+        ("first", lambda g: g[0]),
+        ("last", lambda g: g[-1]),
+        ("mean", statistics.mean),
+        ("var", statistics.pvariance),
+    ]:
+        reduced = wkr.groupby(values, lambda x: x % 3, reducer=name)
+        assert set(reduced) == set(groups)
+        for key, group in groups.items():
+            assert reduced[key] == pytest.approx(func(group))
+    reduced = wkr.groupby(values, lambda x: x % 3, reducer=wkr.TopK(5))
+    for key, group in groups.items():
+        assert reduced[key] == sorted(group, reverse=True)[:5]
+    assert wkr.groupby([1], lambda x: x, reducer=wkr.Variance(ddof=1)) == {
+        1: pytest.approx(float("nan"), nan_ok=True)
+    }
+    with pytest.raises(ValueError):
+        wkr.groupby(values, lambda x: x, reducer="median")
+
+
+def test_groupby_reducer_nested():
+    """Test wkr.groupby with reducers, several keys and value selection."""
+    records = [
+        {"type": "A", "color": "red", "value": 1},
+        {"type": "B", "color": "red", "value": 2},
+        {"type": "A", "color": "blue", "value": 3},
+        {"type": "A", "color": "red", "value": 4},
+    ]
+    assert wkr.groupby(records, "type", "color", reducer=wkr.Sum("value")) == {
+        "A": {"red": 5, "blue": 3},
+        "B": {"red": 2},
+    }
+    assert wkr.groupby(
+        records, "color", reducer=wkr.TopK(1, key="value"), flat=True
+    ) == {"red": [records[3]], "blue": [records[2]]}
+
+
+def test_merge_groups():
+    """Test that wkr.merge_groups combines partial groupings."""
+    values = [random.random() for _ in range(300)]
+    keyfunc = lambda x: int(x * 4)  # noqa: E731
+    for reducer in ["count", "sum", "min", "max", "first", "last", "mean", "var"]:
+        partials = [
+            wkr.groupby(chunk, keyfunc, reducer=reducer, flat=True, finalize=False)
+            for chunk in wkr.chunks(values, 70)
+        ]
+        merged = wkr.finalize_groups(wkr.merge_groups(partials, reducer), reducer)
+        expected = wkr.groupby(values, keyfunc, reducer=reducer)
+        assert merged.keys() == expected.keys()
+        for key in expected:
+            assert merged[key] == pytest.approx(expected[key])
+    partials = [wkr.groupby(chunk, keyfunc) for chunk in wkr.chunks(values, 70)]
+    assert wkr.merge_groups(partials) == wkr.groupby(values, keyfunc)
+    partials = [
+        wkr.groupby(chunk, keyfunc, container=set) for chunk in wkr.chunks(values, 70)
+    ]
+    assert wkr.merge_groups(partials) == wkr.groupby(values, keyfunc, container=set)
+
+
+def test_groupby_arrays():
+    """Test that wkr.groupby_arrays agrees with wkr.groupby."""
+    size = 1000
+    colors = np.array([random.choice(["red", "green", "blue"]) for _ in range(size)])
+    sizes = np.random.randint(0, 4, size)
+    values = np.random.random(size)
+    rows = list(range(size))
+    # index arrays
+    groups = wkr.groupby_arrays(colors)
+    expected = wkr.groupby(rows, lambda i: colors[i])
+    assert {k: v.tolist() for k, v in groups.items()} == expected
+    # nested keys with values
+    groups = wkr.groupby_arrays((colors, sizes), values)
+    expected = wkr.groupby(rows, lambda i: colors[i], lambda i: sizes[i])
+    assert groups.keys() == expected.keys()
+    for color in expected:
+        assert groups[color].keys() == expected[color].keys()
+        for key, indices in expected[color].items():
+            assert groups[color][key].tolist() == values[indices].tolist()
+    # aggregates
+    reducers = {
+        "count": wkr.Count,
+        "sum": wkr.Sum,
+        "min": wkr.Min,
+        "max": wkr.Max,
+        "first": wkr.First,
+        "last": wkr.Last,
+        "mean": wkr.Mean,
+        "var": wkr.Variance,
+    }
+    for name, reducer_class in reducers.items():
+        groups = wkr.groupby_arrays([colors, sizes], values, name, flat=True)
+        expected = wkr.groupby(
+            rows,
+            lambda i: (colors[i], sizes[i]),
+            reducer=reducer_class(values.__getitem__),
+        )
+        assert groups.keys() == expected.keys()
+        for key in expected:
+            assert groups[key] == pytest.approx(expected[key])
+    groups = wkr.groupby_arrays(sizes, values, wkr.TopK(2))
+    for key, top in groups.items():
+        assert top == sorted(values[sizes == key].tolist(), reverse=True)[:2]
+    assert wkr.groupby_arrays(np.array([])) == {}
+    with pytest.raises(ValueError):
+        wkr.groupby_arrays(colors, reducer="sum")
+    with pytest.raises(ValueError):
+        wkr.groupby_arrays([colors, sizes[:10]])
+
+
+def test_groupby_external(tmpdir):
+    """Test that wkr.groupby_external agrees with wkr.groupby."""
+    records = [
+        {"type": random.choice("ABCDE"), "value": random.randint(0, 5)}
+        for _ in range(2000)
+    ]
+    expected = wkr.groupby(records, "type", "value", flat=True)
+    for memory_budget in [10**9, 5000]:
+        groups = wkr.groupby_external(
+            iter(records),
+            "type",
+            "value",
+            memory_budget=memory_budget,
+            num_partitions=7,
+            directory=tmpdir.strpath,
+        )
+        assert dict(groups) == expected
+        # spill files are removed
+        assert not tmpdir.listdir()
+    groups = wkr.groupby_external(
+        records, "type", reducer="count", memory_budget=1000, suffix=".xz"
+    )
+    assert dict(groups) == wkr.groupby(records, "type", reducer="count")
+    with pytest.raises(TypeError):
+        list(wkr.groupby_external(records))
+
+
+def test_groupby_workers():
+    """Test wkr.groupby with several workers."""
+    records = [
+        {"type": random.choice("ABCDE"), "value": random.randint(0, 5)}
+        for _ in range(2000)
+    ]
+    for backend in ["process", "thread"]:
+        kwargs = dict(workers=3, chunk_size=150, backend=backend)
+        assert wkr.groupby(records, "type", "value", **kwargs) == wkr.groupby(
+            records, "type", "value"
+        )
+        assert wkr.groupby(records, "type", **kwargs) == wkr.groupby(records, "type")
+        for reducer in ["count", wkr.Mean("value"), wkr.TopK(3, key="value")]:
+            parallel = wkr.groupby(records, "type", reducer=reducer, **kwargs)
+            serial = wkr.groupby(records, "type", reducer=reducer)
+            assert parallel.keys() == serial.keys()
+            for key in serial:
+                assert parallel[key] == pytest.approx(serial[key])
+    groups = wkr.groupby(
+        range(100), lambda x: x % 3, container=set, workers=2, backend="thread"
+    )
+    assert groups == wkr.groupby(range(100), lambda x: x % 3, container=set)
+
+
+def test_groupby_custom_reducer():
+    """Test wkr.groupby with a user-defined reducer."""
+
+    class Distinct(wkr.Reducer):
+        def init(self):
+            return set()
+
+        def update(self, state, value):
+            state.add(value)
+            return state
+
+        def merge(self, left, right):
+            return left | right
+
+        def result(self, state):
+            return len(state)
+
+    assert wkr.groupby("abracadabra", lambda c: c in "aeiou", reducer=Distinct()) == {
+        True: 1,
+        False: 4,
+    }
+
+
 def test_humanise_bytes():
     """
     Test the wkr.humanise_bytes method.
@@ -282,3 +704,279 @@ def test_reservoir_sampler():
     for it in range(1000):
         c.update(wkr.ReservoirSampler.sample(7, range(100)))
     assert scipy.stats.chisquare(list(c.values())).pvalue > 0.05
+
+
+def test_reservoir_sampler_observe():
+    """
+    Test wkr.ReservoirSampler.observe on individual items.
+    """
+    c = Counter()
+    rng = random.Random(0)
+    for it in range(1000):
+        reservoir = wkr.ReservoirSampler(7, rng=rng)
+        for item in range(100):
+            reservoir.observe(item)
+        assert reservoir.num_observations == 100
+        c.update(reservoir.samples)
+    assert scipy.stats.chisquare(list(c.values())).pvalue > 0.05
+
+
+def test_reservoir_sampler_observe_many():
+    """
+    Test wkr.ReservoirSampler.observe_many on sequences and iterators.
+    """
+    rng = random.Random(0)
+    for make_input in [list, iter, np.array]:
+        c = Counter()
+        for it in range(1000):
+            reservoir = wkr.ReservoirSampler(7, rng=rng)
+            reservoir.observe_many(make_input(range(50)))
+            reservoir.observe_many(make_input(range(50, 100)))
+            assert reservoir.num_observations == 100
+            assert len(set(reservoir.samples)) == 7
+            c.update(int(x) for x in reservoir.samples)
+        assert len(c) == 100
+        assert scipy.stats.chisquare(list(c.values())).pvalue > 0.05
+    assert sorted(wkr.ReservoirSampler.sample(10, iter(range(5)))) == list(range(5))
+    reservoir = wkr.ReservoirSampler(0)
+    reservoir.observe_many(iter(range(5)))
+    reservoir.observe_many(range(5))
+    assert reservoir.samples == []
+    assert reservoir.num_observations == 10
+
+
+def test_reservoir_sampler_random_draws(monkeypatch):
+    """
+    Test that wkr.ReservoirSampler draws few random numbers.
+    """
+    calls = []
+    original_random = random.random
+
+    def counting_random():
+        calls.append(None)
+        return original_random()
+
+    monkeypatch.setattr(random, "random", counting_random)
+    wkr.ReservoirSampler.sample(10, iter(range(100000)))
+    # Algorithm L needs about 2 * n * log(N / n) random numbers
+    assert len(calls) < 1000
+
+
+def test_reservoir_sampler_merge():
+    """
+    Test that merged wkr.ReservoirSamplers sample the union uniformly.
+    """
+    c = Counter()
+    rng = random.Random(0)
+    for it in range(1000):
+        left = wkr.ReservoirSampler(7, rng=rng)
+        left.observe_many(range(30))
+        right = wkr.ReservoirSampler(7, rng=rng)
+        right.observe_many(range(30, 70))
+        merged = left.merge(right)
+        # the merged reservoir can go on observing items
+        merged.observe_many(iter(range(70, 100)))
+        assert merged.num_observations == 100
+        assert len(set(merged.samples)) == 7
+        c.update(merged.samples)
+    assert len(c) == 100
+    assert scipy.stats.chisquare(list(c.values())).pvalue > 0.05
+    # merging reservoirs that are not full
+    left = wkr.ReservoirSampler(7)
+    left.observe_many(range(3))
+    right = wkr.ReservoirSampler(7)
+    right.observe_many(range(3, 5))
+    assert sorted(left.merge(right).samples) == list(range(5))
+    with pytest.raises(ValueError):
+        left.merge(wkr.ReservoirSampler(3))
+
+
+def test_weighted_reservoir_sampler():
+    """
+    Test wkr.WeightedReservoirSampler.
+    """
+    weights = [1, 2, 3, 4, 0]
+    c = Counter()
+    rng = random.Random(0)
+    for it in range(4000):
+        c.update(
+            wkr.WeightedReservoirSampler.sample(1, zip(range(5), weights), rng=rng)
+        )
+    assert c[4] == 0
+    observed = [c[item] for item in range(4)]
+    expected = [4000 * w / 10 for w in weights[:4]]
+    assert scipy.stats.chisquare(observed, expected).pvalue > 0.01
+    # with equal weights, the sample is uniform
+    c = Counter()
+    for it in range(1000):
+        left = wkr.WeightedReservoirSampler(7, rng=rng)
+        left.observe_many((item, 1.0) for item in range(40))
+        right = wkr.WeightedReservoirSampler(7, rng=rng)
+        right.observe_many((item, 1.0) for item in range(40, 100))
+        merged = left.merge(right)
+        assert merged.num_observations == 100
+        assert len(set(merged.samples)) == 7
+        c.update(merged.samples)
+    assert scipy.stats.chisquare(list(c.values())).pvalue > 0.05
+    with pytest.raises(ValueError):
+        wkr.WeightedReservoirSampler(1).observe("a", -1)
+
+
+def test_reservoir_sampler_pickle():
+    """
+    Test that reservoir samplers survive pickling.
+    """
+    for reservoir in [wkr.ReservoirSampler(5), wkr.WeightedReservoirSampler(5)]:
+        assert not hasattr(reservoir, "__dict__")
+        for item in range(20):
+            if isinstance(reservoir, wkr.ReservoirSampler):
+                reservoir.observe(item)
+            else:
+                reservoir.observe(item, 1.0)
+        copy = pickle.loads(pickle.dumps(reservoir))
+        assert copy.samples == reservoir.samples
+        assert copy.num_observations == reservoir.num_observations
+
+
+def test_reservoir_sampler_rng():
+    """
+    Test that reservoir samplers are reproducible given an explicit rng.
+    """
+    for make_rng in [random.Random, np.random.default_rng, wkr.BatchedRandom]:
+        samples = []
+        for _ in range(2):
+            reservoir = wkr.ReservoirSampler(5, rng=make_rng(42))
+            reservoir.observe_many(iter(range(1000)))
+            weighted = wkr.WeightedReservoirSampler(5, rng=make_rng(42))
+            weighted.observe_many((item, item % 7 + 1) for item in range(1000))
+            merged = reservoir.merge(reservoir)
+            samples.append((reservoir.samples, weighted.samples, merged.samples))
+        assert samples[0] == samples[1]
+    c = Counter()
+    rng = np.random.default_rng(0)
+    for it in range(1000):
+        c.update(wkr.ReservoirSampler.sample(7, range(100), rng=rng))
+    assert scipy.stats.chisquare(list(c.values())).pvalue > 0.05
+
+
+def test_batched_random():
+    """
+    Test wkr.BatchedRandom.
+    """
+    rng = wkr.BatchedRandom(0, batch_size=100)
+    values = [rng.random() for _ in range(1000)]
+    assert all(0 <= x < 1 for x in values)
+    assert len(set(values)) == 1000
+    assert sorted(set(rng.randrange(3) for _ in range(100))) == [0, 1, 2]
+    assert 0 < rng.betavariate(2, 5) < 1
+    copy = pickle.loads(pickle.dumps(rng))
+    assert [copy.random() for _ in range(300)] == [rng.random() for _ in range(300)]
+
+
+def test_shuffled():
+    """
+    Test wkr.shuffled.
+    """
+    values = list(range(100))
+    assert sorted(wkr.shuffled(iter(values))) == values
+    for make_rng in [random.Random, np.random.default_rng]:
+        shuffled = wkr.shuffled(values, rng=make_rng(1))
+        assert shuffled != values
+        assert sorted(shuffled) == values
+        assert wkr.shuffled(values, rng=make_rng(1)) == shuffled
+
+
+def test_shuffled_buffer():
+    """
+    Test wkr.shuffled with a bounded buffer.
+    """
+    values = list(range(1000))
+    result = wkr.shuffled(iter(values), rng=random.Random(0), buffer_size=100)
+    assert not isinstance(result, list)
+    result = list(result)
+    assert result != values
+    assert sorted(result) == values
+    assert sorted(wkr.shuffled(range(10), buffer_size=100)) == list(range(10))
+    assert list(wkr.shuffled([], buffer_size=10)) == []
+    with pytest.raises(ValueError):
+        wkr.shuffled(values, buffer_size=0)
+
+
+def test_external_shuffled(tmpdir):
+    """
+    Test wkr.external_shuffled.
+    """
+    values = [("item", idx) for idx in range(2000)]
+    result = list(
+        wkr.external_shuffled(
+            iter(values),
+            num_buckets=8,
+            rng=random.Random(0),
+            directory=tmpdir.strpath,
+            batch_size=50,
+        )
+    )
+    assert result != values
+    assert sorted(result) == values
+    assert not tmpdir.listdir()
+    # every item is equally likely to end up in the first position
+    c = Counter()
+    rng = random.Random(0)
+    for it in range(1000):
+        c[next(iter(wkr.external_shuffled(range(10), 3, rng, batch_size=2)))] += 1
+    assert scipy.stats.chisquare(list(c.values())).pvalue > 0.01
+
+
+def test_stratified_reservoir_sampler():
+    """
+    Test wkr.StratifiedReservoirSampler.
+    """
+    counters = {True: Counter(), False: Counter()}
+    rng = random.Random(0)
+    for it in range(1000):
+        samples = wkr.StratifiedReservoirSampler.sample(
+            5, lambda x: x < 40, iter(range(100)), rng=rng
+        )
+        assert samples.keys() == {True, False}
+        for key, sample in samples.items():
+            assert len(set(sample)) == 5
+            assert all((x < 40) == key for x in sample)
+            counters[key].update(sample)
+    for counter in counters.values():
+        assert scipy.stats.chisquare(list(counter.values())).pvalue > 0.05
+    reservoir = wkr.StratifiedReservoirSampler(3, "type", rng=random.Random(1))
+    reservoir.observe({"type": "A"})
+    reservoir.observe_many([{"type": "B"}, {"type": "A"}])
+    assert reservoir.num_observations == 3
+    assert reservoir.samples == {"A": [{"type": "A"}] * 2, "B": [{"type": "B"}]}
+    assert pickle.loads(pickle.dumps(reservoir)).samples == reservoir.samples
+
+
+def test_decayed_reservoir_sampler():
+    """
+    Test wkr.DecayedReservoirSampler.
+    """
+    rng = random.Random(0)
+    reservoir = wkr.DecayedReservoirSampler(10, half_life=50, rng=rng)
+    reservoir.observe_many(range(2000))
+    assert reservoir.num_observations == 2000
+    (sample,) = reservoir.samples.values()
+    assert len(set(sample)) == 10
+    # recent items are strongly preferred
+    assert statistics.mean(sample) > 1800
+    # with a very long half-life, the sample is close to uniform
+    c = Counter()
+    for it in range(1000):
+        reservoir = wkr.DecayedReservoirSampler(
+            7, half_life=1e12, key=lambda x: x % 2, rng=rng
+        )
+        reservoir.observe_many(range(100))
+        samples = reservoir.samples
+        assert samples.keys() == {0, 1}
+        assert all(x % 2 == key for key, sample in samples.items() for x in sample)
+        c.update(samples[0])
+    assert scipy.stats.chisquare(list(c.values())).pvalue > 0.05
+    # explicit timestamps
+    reservoir = wkr.DecayedReservoirSampler(1, half_life=1e-3)
+    reservoir.observe_many("abc", timestamps=[3, 1, 2])
+    assert reservoir.samples == {None: ["a"]}
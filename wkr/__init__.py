@@ -11,23 +11,44 @@ __init__.py
 
 from __future__ import absolute_import
 
+import collections.abc
 import functools
+import heapq
+import itertools
 import math
+import multiprocessing
+import operator
+import pickle
 import random
 import sys
-from collections import defaultdict
-from itertools import tee
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from itertools import islice, tee
 from typing import Any, Iterable, List
 
 from .compat import string_types
-from .io import lines
+from .io import lines, open_file
 from .io import open_file as open
-from .os import mkdir_p
+from .os import mkdir_p, temp_file_name
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 __author__ = """Will Roberts"""
 __email__ = "wildwilhelm@gmail.com"
 __version__ = "1.0.3"
 
+_NO_DEFAULT_VALUE_SENTINAL = {}
+
 
 def memoize(func):
     """
@@ -83,6 +104,11 @@ def reduce_sets_or(sets):
     return retval
 
 
+def _is_ndarray(value):
+    """Return True if `value` is a NumPy array (and NumPy is installed)."""
+    return np is not None and isinstance(value, np.ndarray)
+
+
 def rle(seq, keyfunc=None):
     """
     Run-length encode a sequence of values.
@@ -93,33 +119,226 @@ def rle(seq, keyfunc=None):
     `begin` and `end` are indices into the passed sequence, begin
     inclusive and end exclusive.
 
+    If `seq` is a NumPy array and no `keyfunc` is given, the run
+    boundaries are computed in vectorized form by :func:`rle_array`.
+
     :param iterable seq:
     :param function keyfunc: optional, a function to specify how
         values should be grouped.  Defaults to lambda x: x.
     """
-    idx = None
-    for idx, symbol in enumerate(seq):
-        if idx == 0:
-            begin_symbol = symbol
-            begin_idx = idx
-        else:
-            if keyfunc is None:
-                unequal = symbol != begin_symbol
-            else:
-                unequal = keyfunc(symbol) != keyfunc(begin_symbol)
-            if unequal:
+    if keyfunc is None and _is_ndarray(seq):
+        symbols, begins, ends = rle_array(seq)
+        return zip(symbols, begins.tolist(), ends.tolist())
+    return _rle_iter(seq, keyfunc)
+
+
+def _rle_iter(seq, keyfunc):
+    """Pure-Python implementation of `rle`."""
+    iterator = iter(seq)
+    try:
+        begin_symbol = next(iterator)
+    except StopIteration:
+        return
+    begin_idx = idx = 0
+    if keyfunc is None:
+        for idx, symbol in enumerate(iterator, 1):
+            if symbol != begin_symbol:
                 yield (begin_symbol, begin_idx, idx)
                 begin_symbol = symbol
                 begin_idx = idx
-    if idx is not None:
-        yield (begin_symbol, begin_idx, idx + 1)
+    else:
+        # cache the key of the current run, so that keyfunc is called
+        # only once per element
+        begin_key = keyfunc(begin_symbol)
+        for idx, symbol in enumerate(iterator, 1):
+            key = keyfunc(symbol)
+            if key != begin_key:
+                yield (begin_symbol, begin_idx, idx)
+                begin_symbol = symbol
+                begin_key = key
+                begin_idx = idx
+    yield (begin_symbol, begin_idx, idx + 1)
+
+
+def rle_array(arr):
+    """
+    Run-length encode a NumPy array.
+
+    Returns a tuple of arrays `(symbols, begins, ends)`, where
+    `symbols[i]` is the value of the i-th run, which spans the indices
+    `begins[i]` (inclusive) to `ends[i]` (exclusive).  Runs are
+    computed along the first axis, so the rows of a 2-D array are
+    treated as the symbols.
+
+    :param numpy.ndarray arr:
+    """
+    arr = np.asarray(arr)
+    length = len(arr)
+    if length == 0:
+        begins = np.zeros(0, dtype=np.intp)
+        return arr[begins], begins, begins.copy()
+    changed = arr[1:] != arr[:-1]
+    if changed.ndim > 1:
+        changed = changed.reshape(length - 1, -1).any(axis=1)
+    begins = np.concatenate(([0], np.flatnonzero(changed) + 1))
+    ends = np.append(begins[1:], length)
+    return arr[begins], begins, ends
+
+
+def rle_decode(runs):
+    """
+    Invert run-length encoding.
+
+    `runs` is either an iterable of `(symbol, begin, end)` tuples as
+    produced by :func:`rle`, in which case a list is returned, or the
+    `(symbols, begins, ends)` arrays produced by :func:`rle_array`, in
+    which case an array is returned.
+
+    Note that if `rle` was called with a `keyfunc`, every element of a
+    run is decoded as the first symbol of that run.
+
+    :param runs:
+    """
+    if (
+        isinstance(runs, tuple)
+        and len(runs) == 3
+        and all(_is_ndarray(part) for part in runs)
+    ):
+        symbols, begins, ends = runs
+        return np.repeat(symbols, ends - begins, axis=0)
+    retval = []
+    for symbol, begin, end in runs:
+        retval.extend([symbol] * (end - begin))
+    return retval
+
+
+def _symbols_equal(left, right):
+    """Compare two run symbols, including rows of NumPy arrays."""
+    if _is_ndarray(left) or _is_ndarray(right):
+        return np.array_equal(left, right)
+    return left == right
+
+
+class RLEEncoder:
+    """
+    Incremental run-length encoder.
+
+    Chunks of a (possibly unbounded) sequence are passed to `encode`,
+    which returns the runs that have been closed so far as `(symbol,
+    begin, end)` tuples, with indices relative to the start of the
+    whole stream.  The run that is still open at the end of a chunk is
+    carried over to the next one, so that runs are never split at
+    chunk boundaries.  Call `flush` after the last chunk to get the
+    final run.
+
+    NumPy array chunks are encoded with :func:`rle_array`.
+
+    :param function keyfunc: optional, a function to specify how
+        values should be grouped.  Defaults to lambda x: x.
+    """
+
+    def __init__(self, keyfunc=None):
+        self.keyfunc = keyfunc
+        self.num_observations = 0
+        # (symbol, key, begin) of the run that is still open
+        self._open_run = None
+
+    def encode(self, chunk):
+        """
+        Encode the next chunk of the stream.
+
+        Returns a list of the runs that were closed by this chunk.
+
+        :param iterable chunk:
+        """
+        offset = self.num_observations
+        closed = []
+        open_run = self._open_run
+        keyfunc = self.keyfunc
+        end = 0
+        for symbol, begin, end in rle(chunk, keyfunc):
+            key = symbol if keyfunc is None else keyfunc(symbol)
+            if open_run is not None and _symbols_equal(open_run[1], key):
+                continue
+            if open_run is not None:
+                closed.append((open_run[0], open_run[2], offset + begin))
+            open_run = (symbol, key, offset + begin)
+        self._open_run = open_run
+        self.num_observations = offset + end
+        return closed
+
+    def flush(self):
+        """Close the open run, returning it in a list (empty if none)."""
+        if self._open_run is None:
+            return []
+        symbol, _key, begin = self._open_run
+        self._open_run = None
+        return [(symbol, begin, self.num_observations)]
+
+    @staticmethod
+    def encode_chunks(chunks, keyfunc=None):
+        """
+        Run-length encode a stream given as an iterable of chunks.
+
+        This is a generator yielding the same tuples as :func:`rle`
+        would for the concatenation of all chunks.
+
+        :param iterable chunks:
+        :param function keyfunc:
+        """
+        encoder = RLEEncoder(keyfunc)
+        for chunk in chunks:
+            for run in encoder.encode(chunk):
+                yield run
+        for run in encoder.flush():
+            yield run
 
 
 # https://stackoverflow.com/a/312464/1062499
-def chunks(iterable, n):
-    """Yield successive `n`-sized chunks from `iterable`."""
+def chunks(
+    iterable, n, collate=None, drop_last=False, pad=_NO_DEFAULT_VALUE_SENTINAL
+):
+    """
+    Yield successive `n`-sized chunks from `iterable`.
+
+    Lists are chunked by slicing, and NumPy arrays yield views into the
+    original array rather than copies; any other iterable yields lists.
+
+    :param iterable iterable:
+    :param int n: the chunk size
+    :param collate: optional, a function applied to each chunk before
+        it is yielded.  Pass True to stack each chunk into a NumPy
+        array with `numpy.asarray`.
+    :param bool drop_last: if True, a final chunk shorter than `n` is
+        dropped.
+    :param pad: if given, a final chunk shorter than `n` is padded to
+        length `n` with this value.
+    """
     if n <= 0:
         raise ValueError("n must be a positive integer")
+    if drop_last and pad is not _NO_DEFAULT_VALUE_SENTINAL:
+        raise ValueError("drop_last and pad cannot be used together")
+    if collate is True:
+        collate = np.asarray
+    if isinstance(iterable, list) or _is_ndarray(iterable):
+        batches = (
+            iterable[idx:idx + n] for idx in range(0, len(iterable), n)
+        )
+    else:
+        batches = _chunks_iter(iterable, n)
+    for batch in batches:
+        if len(batch) < n:
+            if drop_last:
+                return
+            if pad is not _NO_DEFAULT_VALUE_SENTINAL:
+                batch = _pad_chunk(batch, n, pad)
+        if collate is not None:
+            batch = collate(batch)
+        yield batch
+
+
+def _chunks_iter(iterable, n):
+    """Yield successive `n`-sized lists from an arbitrary iterable."""
     lval = []
     for item in iterable:
         lval.append(item)
@@ -130,6 +349,128 @@ def chunks(iterable, n):
         yield lval
 
 
+def _pad_chunk(batch, n, pad):
+    """Pad a list or array `batch` up to length `n` with `pad`."""
+    if _is_ndarray(batch):
+        padding = np.full((n - len(batch),) + batch.shape[1:], pad)
+        return np.concatenate((batch, padding))
+    return batch + [pad] * (n - len(batch))
+
+
+# target wall-clock duration of one batch when parallel_map picks the
+# chunk size itself
+_PARALLEL_MAP_TARGET_SECONDS = 0.05
+_PARALLEL_MAP_MAX_CHUNK_SIZE = 65536
+
+
+def _map_chunk(func, chunk):
+    """Apply `func` to every item of `chunk`, timing the whole batch."""
+    start = time.perf_counter()
+    results = [func(item) for item in chunk]
+    return results, time.perf_counter() - start
+
+
+def _adaptive_chunks(iterable, size):
+    """Yield lists from `iterable` whose length is read from `size[0]`."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size[0]))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _next_chunk_size(size, num_items, elapsed):
+    """Pick a chunk size so that one batch takes about the target time."""
+    if elapsed <= 0:
+        new_size = 2 * size
+    else:
+        new_size = int(_PARALLEL_MAP_TARGET_SECONDS * num_items / elapsed)
+    # grow at most by a factor of two at a time, shrink immediately
+    return max(1, min(new_size, 2 * size, _PARALLEL_MAP_MAX_CHUNK_SIZE))
+
+
+def parallel_map(
+    func,
+    iterable,
+    workers=None,
+    chunk_size="auto",
+    ordered=True,
+    backend="thread",
+    prefetch=None,
+):
+    """
+    Apply `func` to every item of `iterable` in parallel.
+
+    This is a generator yielding the results of `func`.  Items are
+    batched with :func:`chunks` and each batch is handed to a worker
+    as a single task; at most `prefetch` batches are in flight at a
+    time, so that `iterable` is consumed only as fast as the workers
+    can keep up.
+
+    If a call to `func` raises an exception, the remaining batches are
+    cancelled and the exception is re-raised in the caller.
+
+    :param callable func: must be picklable for the process backend
+    :param iterable iterable:
+    :param int workers: number of workers; defaults to the CPU count
+    :param chunk_size: number of items per batch, or "auto" to adapt
+        the batch size to the observed time per item
+    :param bool ordered: if True (the default), results are yielded in
+        input order; otherwise in order of completion
+    :param str backend: "thread" or "process"
+    :param int prefetch: maximum number of batches in flight; defaults
+        to twice the number of workers
+    """
+    if backend == "thread":
+        executor_class = ThreadPoolExecutor
+    elif backend == "process":
+        executor_class = ProcessPoolExecutor
+    else:
+        raise ValueError("backend must be 'thread' or 'process'")
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if prefetch is None:
+        prefetch = 2 * workers
+    adaptive = chunk_size == "auto"
+    if adaptive:
+        size = [1]
+        batches = _adaptive_chunks(iterable, size)
+    else:
+        batches = chunks(iterable, chunk_size)
+    with executor_class(max_workers=workers) as executor:
+        pending = deque() if ordered else set()
+
+        def harvest():
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                future = done.pop()
+                pending.remove(future)
+            results, elapsed = future.result()
+            if adaptive:
+                size[0] = _next_chunk_size(size[0], len(results), elapsed)
+            return results
+
+        try:
+            for batch in batches:
+                future = executor.submit(_map_chunk, func, batch)
+                if ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+                while len(pending) >= prefetch:
+                    for result in harvest():
+                        yield result
+            while pending:
+                for result in harvest():
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
 # https://docs.python.org/3/library/itertools.html#itertools-recipes
 def pairwise(iterable):
     "s -> (s0,s1), (s1,s2), (s2, s3), ..."
@@ -138,13 +479,508 @@ def pairwise(iterable):
     return zip(a, b)
 
 
+def windowed(iterable, n, step=1, fill=_NO_DEFAULT_VALUE_SENTINAL):
+    """
+    Yield sliding windows of `n` consecutive items from `iterable`.
+
+    s -> (s0, ..., s[n-1]), (s[step], ..., s[step+n-1]), ...
+
+    Windows are tuples, built from a ring buffer so that each item is
+    stored only once.  If `fill` is given, a final incomplete window is
+    padded with it, so that every item appears in some window;
+    otherwise only complete windows are yielded.
+
+    If `iterable` is a NumPy array, a read-only array of shape `(num_windows,
+    n) + iterable.shape[1:]` is returned instead, which shares memory
+    with `iterable`.
+
+    :param iterable iterable:
+    :param int n: the window size
+    :param int step: the distance between the starts of consecutive
+        windows
+    :param fill: optional padding value
+    """
+    if n <= 0:
+        raise ValueError("n must be a positive integer")
+    if step <= 0:
+        raise ValueError("step must be a positive integer")
+    if _is_ndarray(iterable):
+        return _windowed_array(iterable, n, step, fill)
+    return _windowed_iter(iterable, n, step, fill)
+
+
+def _windowed_iter(iterable, n, step, fill):
+    """Pure-Python implementation of `windowed`."""
+    iterator = iter(iterable)
+    window = deque(islice(iterator, n), maxlen=n)
+    if len(window) < n:
+        if window and fill is not _NO_DEFAULT_VALUE_SENTINAL:
+            yield tuple(window) + (fill,) * (n - len(window))
+        return
+    yield tuple(window)
+    if step == 1:
+        for item in iterator:
+            window.append(item)
+            yield tuple(window)
+        return
+    # when step > n, the first step - n new items fall between windows
+    num_skipped = max(0, step - n)
+    while True:
+        num_new = 0
+        for item in islice(iterator, step):
+            window.append(item)
+            num_new += 1
+        if num_new == step:
+            yield tuple(window)
+        else:
+            if (num_new > num_skipped
+                    and fill is not _NO_DEFAULT_VALUE_SENTINAL):
+                window.extend([fill] * (step - num_new))
+                yield tuple(window)
+            return
+
+
+def _windowed_array(arr, n, step, fill):
+    """Zero-copy implementation of `windowed` for NumPy arrays."""
+    length = len(arr)
+    if fill is not _NO_DEFAULT_VALUE_SENTINAL and length:
+        # pad if some item after the last complete window falls inside
+        # the window after it
+        if length < n:
+            next_start, covered = 0, 0
+        else:
+            next_start = ((length - n) // step + 1) * step
+            covered = next_start - step + n
+        if covered < length and next_start < length:
+            padded_length = next_start + n
+            padding = np.full((padded_length - length,) + arr.shape[1:], fill)
+            arr = np.concatenate((arr, padding))
+            length = padded_length
+    num_windows = (length - n) // step + 1 if length >= n else 0
+    return np.lib.stride_tricks.as_strided(
+        arr,
+        shape=(num_windows, n) + arr.shape[1:],
+        strides=(arr.strides[0] * step, arr.strides[0]) + arr.strides[1:],
+        writeable=False,
+    )
+
+
+def _compile_key(key):
+    """Turn a groupby key (an item key or a function) into a function."""
+    if isinstance(key, string_types):
+        return operator.itemgetter(key)
+    return key
+
+
+def _compile_keys(keys):
+    """
+    Combine one or more groupby keys into a single key function.
+
+    With one key, the function returns that key's value; with several,
+    it returns a tuple of their values.  Item key strings are compiled
+    to `operator.itemgetter`, so that several string keys are looked
+    up in a single C-level call.
+    """
+    if len(keys) == 1:
+        return _compile_key(keys[0])
+    if all(isinstance(key, string_types) for key in keys):
+        return operator.itemgetter(*keys)
+    keyfuncs = [_compile_key(key) for key in keys]
+    return lambda item: tuple([keyfunc(item) for keyfunc in keyfuncs])
+
+
+def _group_items(iterable, keyfunc, container):
+    """Sort the items of `iterable` into a flat dictionary of containers."""
+    groups = defaultdict(container)
+    # decide once whether the container is filled with add() or append()
+    if hasattr(container(), "add"):
+        for item in iterable:
+            groups[keyfunc(item)].add(item)
+    else:
+        for item in iterable:
+            groups[keyfunc(item)].append(item)
+    return groups
+
+
+def _group_chunk(keys, container, reducer, chunk):
+    """Compute the flat partial grouping of one chunk of the input."""
+    keyfunc = _compile_keys(keys)
+    if reducer is None:
+        return _group_items(chunk, keyfunc, container)
+    return _reduce_items(chunk, keyfunc, reducer)
+
+
+def nest_groups(groups, depth, container=None):
+    """
+    Convert a flat grouping into a nested dictionary structure.
+
+    `groups` maps tuples of `depth` key values to groups, as returned
+    by ``groupby(..., flat=True)``; with `depth` 1, the keys are plain
+    values instead.  The result has one dictionary level per key.
+
+    :param dict groups:
+    :param int depth: the number of keys used for grouping
+    :param callable container: if given, the result is built from
+        nested defaultdicts ending in `container`, exactly like the
+        default output of :func:`groupby`; otherwise from plain dicts.
+    """
+    if container is None:
+        result = {}
+        if depth == 1:
+            result.update(groups)
+            return result
+        for key, group in groups.items():
+            pointer = result
+            for part in key[:-1]:
+                pointer = pointer.setdefault(part, {})
+            pointer[key[-1]] = group
+        return result
+    # construct a nested defaultdict of the correct depth
+    # e.g., ddx(list)() is defaultdict(list, {}); ddx(ddx(list))() is
+    # defaultdict(lambda: defaultdict(list)); etc.
+    ddx = lambda x: lambda: defaultdict(x)  # noqa: E731
+    result = functools.reduce(lambda x, y: y(x), [ddx] * depth, container)()
+    if depth == 1:
+        result.update(groups)
+        return result
+    for key, group in groups.items():
+        pointer = result
+        for part in key[:-1]:
+            pointer = pointer[part]
+        pointer[key[-1]] = group
+    return result
+
+
+class Reducer:
+    """
+    Base class for streaming aggregates, for use with ``groupby(...,
+    reducer=...)``.
+
+    A reducer keeps one state per group instead of a container of
+    items: `init` creates a state, `update` folds a value into a state
+    and returns the new state, `merge` combines the states of two
+    disjoint parts of the input (`left` covering the earlier items),
+    and `result` turns a state into the final aggregate.
+
+    :param value: optional, a function (or item key string) selecting
+        the value to aggregate from each item.  Defaults to the item
+        itself.
+    """
+
+    def __init__(self, value=None):
+        self.value = None if value is None else _compile_key(value)
+
+    def init(self):
+        raise NotImplementedError
+
+    def update(self, state, value):
+        raise NotImplementedError
+
+    def merge(self, left, right):
+        raise NotImplementedError
+
+    def result(self, state):
+        return state
+
+
+_EMPTY_STATE = object()
+
+
+class Count(Reducer):
+    """Count the items of each group."""
+
+    def init(self):
+        return 0
+
+    def update(self, state, value):
+        return state + 1
+
+    def merge(self, left, right):
+        return left + right
+
+
+class Sum(Reducer):
+    """Sum the values of each group."""
+
+    def init(self):
+        return 0
+
+    def update(self, state, value):
+        return state + value
+
+    def merge(self, left, right):
+        return left + right
+
+
+class Min(Reducer):
+    """Find the smallest value of each group."""
+
+    def init(self):
+        return _EMPTY_STATE
+
+    def update(self, state, value):
+        return value if state is _EMPTY_STATE or value < state else state
+
+    def merge(self, left, right):
+        if right is _EMPTY_STATE:
+            return left
+        return self.update(left, right)
+
+
+class Max(Reducer):
+    """Find the largest value of each group."""
+
+    def init(self):
+        return _EMPTY_STATE
+
+    def update(self, state, value):
+        return value if state is _EMPTY_STATE or value > state else state
+
+    def merge(self, left, right):
+        if right is _EMPTY_STATE:
+            return left
+        return self.update(left, right)
+
+
+class First(Reducer):
+    """Keep the first value of each group."""
+
+    def init(self):
+        return _EMPTY_STATE
+
+    def update(self, state, value):
+        return value if state is _EMPTY_STATE else state
+
+    def merge(self, left, right):
+        return right if left is _EMPTY_STATE else left
+
+
+class Last(Reducer):
+    """Keep the last value of each group."""
+
+    def init(self):
+        return _EMPTY_STATE
+
+    def update(self, state, value):
+        return value
+
+    def merge(self, left, right):
+        return left if right is _EMPTY_STATE else right
+
+
+class Mean(Reducer):
+    """
+    Compute the mean of the values of each group.
+
+    Uses Welford's online algorithm; states are `[count, mean, m2]`,
+    where `m2` is the sum of squared differences from the mean.
+    """
+
+    def init(self):
+        return [0, 0.0, 0.0]
+
+    def update(self, state, value):
+        state[0] += 1
+        delta = value - state[1]
+        state[1] += delta / state[0]
+        state[2] += delta * (value - state[1])
+        return state
+
+    def merge(self, left, right):
+        # Chan et al.'s parallel variant of Welford's algorithm
+        count = left[0] + right[0]
+        if not count:
+            return [0, 0.0, 0.0]
+        delta = right[1] - left[1]
+        mean = left[1] + delta * right[0] / count
+        m2 = left[2] + right[2] + delta * delta * left[0] * right[0] / count
+        return [count, mean, m2]
+
+    def result(self, state):
+        return state[1]
+
+
+class Variance(Mean):
+    """
+    Compute the variance of the values of each group.
+
+    :param int ddof: delta degrees of freedom; the divisor used is
+        `count - ddof`.  Defaults to 0 (the population variance).
+    """
+
+    def __init__(self, value=None, ddof=0):
+        super().__init__(value)
+        self.ddof = ddof
+
+    def result(self, state):
+        if state[0] <= self.ddof:
+            return float("nan")
+        return state[2] / (state[0] - self.ddof)
+
+
+class TopK(Reducer):
+    """
+    Keep the `k` largest values of each group.
+
+    The result is a list of at most `k` values, largest first.
+
+    :param int k:
+    :param key: optional, a function (or item key string) giving the
+        quantity to rank values by.  Defaults to the value itself.
+    """
+
+    def __init__(self, k, key=None, value=None):
+        super().__init__(value)
+        self.k = k
+        self.key = None if key is None else _compile_key(key)
+
+    def init(self):
+        # (rank, value) pairs, pruned back to k whenever there are 2k
+        return []
+
+    def _prune(self, state):
+        return heapq.nlargest(self.k, state, key=operator.itemgetter(0))
+
+    def update(self, state, value):
+        state.append((value if self.key is None else self.key(value), value))
+        if len(state) >= 2 * self.k:
+            state = self._prune(state)
+        return state
+
+    def merge(self, left, right):
+        return self._prune(left + right)
+
+    def result(self, state):
+        return [value for _rank, value in self._prune(state)]
+
+
+_REDUCERS = {
+    "count": Count,
+    "sum": Sum,
+    "min": Min,
+    "max": Max,
+    "first": First,
+    "last": Last,
+    "mean": Mean,
+    "var": Variance,
+}
+
+
+def _get_reducer(reducer):
+    """Look up a reducer given by name, or pass through a reducer object."""
+    if isinstance(reducer, string_types):
+        try:
+            return _REDUCERS[reducer]()
+        except KeyError:
+            raise ValueError("unknown reducer {!r}".format(reducer))
+    return reducer
+
+
+def _reduce_items(iterable, keyfunc, reducer):
+    """Fold the items of `iterable` into a flat dict of reducer states."""
+    if type(reducer) is Count:
+        return Counter(map(keyfunc, iterable))
+    states = {}
+    init = reducer.init
+    update = reducer.update
+    getter = getattr(reducer, "value", None)
+    if getter is None:
+        for item in iterable:
+            key = keyfunc(item)
+            try:
+                state = states[key]
+            except KeyError:
+                state = init()
+            states[key] = update(state, item)
+    else:
+        for item in iterable:
+            key = keyfunc(item)
+            try:
+                state = states[key]
+            except KeyError:
+                state = init()
+            states[key] = update(state, getter(item))
+    return states
+
+
+def finalize_groups(groups, reducer):
+    """
+    Turn a flat dictionary of reducer states into final results.
+
+    :param dict groups: as returned by ``groupby(..., flat=True,
+        finalize=False)`` or :func:`merge_groups`
+    :param reducer: a :class:`Reducer` or the name of a built-in one
+    """
+    result = _get_reducer(reducer).result
+    return {key: result(state) for key, state in groups.items()}
+
+
+def merge_groups(partials, reducer=None):
+    """
+    Merge flat groupings computed over disjoint parts of the input.
+
+    `partials` are results of ``groupby(..., flat=True)``, in input
+    order; when grouping with a reducer, they must have been computed
+    with ``finalize=False``.  Groups are merged by list concatenation,
+    set union or the reducer's `merge`.  The partial results are
+    modified in place.
+
+    :param iterable partials:
+    :param reducer: the reducer used to compute the partials, if any
+    """
+    if reducer is not None:
+        merge = _get_reducer(reducer).merge
+    merged = {}
+    for partial in partials:
+        for key, group in partial.items():
+            try:
+                existing = merged[key]
+            except KeyError:
+                merged[key] = group
+                continue
+            if reducer is not None:
+                merged[key] = merge(existing, group)
+            elif hasattr(existing, "add"):
+                existing.update(group)
+            else:
+                existing.extend(group)
+    return merged
+
+
 def groupby(iterable, *keys, **kwargs):
     """
     Groups objects from iterable into a dictionary structure.
 
+    Items are first grouped into a flat dictionary keyed on the tuple
+    of all key values (one dictionary lookup per item); the nested
+    structure with one level per key is built from that afterwards.
+
     :param iterable iterable: source of objects to sort
-    :param str or callable key: one or more functions to sort the object
+    :param str or callable key: one or more functions to sort the
+        object.  A string `k` stands for the function lambda x: x[k].
     :param callable container: Defaults to list.  You can pass "set" to this.
+    :param bool flat: Defaults to False.  If True, return the flat
+        dictionary keyed on tuples of key values instead (or on the
+        plain key values if there is only one key); see
+        :func:`nest_groups`.
+    :param reducer: optional, a :class:`Reducer` (or the name of a
+        built-in one: "count", "sum", "min", "max", "first", "last",
+        "mean" or "var") to aggregate each group in O(1) memory
+        instead of storing its items in a container.
+    :param bool finalize: Defaults to True.  If False, the reducer
+        states are returned instead of the final aggregates, so that
+        partial results can be combined with :func:`merge_groups`.
+
+    :param int workers: optional, the number of worker processes.  If
+        given, the input is split with :func:`chunks`, each chunk is
+        grouped by a worker, and the partial results are merged with
+        :func:`merge_groups`.  Keys and reducers must then be
+        picklable (strings, module-level functions, `operator`
+        getters).
+    :param int chunk_size: number of items per chunk with `workers`.
+        Defaults to 10000.
+    :param str backend: "process" (the default) or "thread", see
+        :func:`parallel_map`.
     """
     # pretend that we have a required second positional argument "key"
     if not keys:
@@ -152,32 +988,278 @@ def groupby(iterable, *keys, **kwargs):
     # pretend that we have a keyword argument "container" with a
     # default value of list
     container = kwargs.get("container", list)
-    # construct a nested defaultdict of the correct depth
-    # e.g., ddx(list)() is defaultdict(list, {}); ddx(ddx(list))() is
-    # defaultdict(lambda: defaultdict(list)); etc.
-    ddx = lambda x: lambda: defaultdict(x)
-    result = functools.reduce(lambda x, y: y(x), [ddx for _ in keys], container)()
-    # transform keys if necessary
-    keyfuncs = []
-    for key in keys:
-        if isinstance(key, string_types):
-            key = (lambda k: lambda x: x[k])(key)
-        keyfuncs.append(key)
-    # sort each item of the iterable into the result dictionary
-    for item in iterable:
-        pointer = result
-        # run down the key list
-        for keyfunc in keyfuncs:
-            value = keyfunc(item)
-            pointer = pointer[value]
-        if hasattr(pointer, "add"):
-            pointer.add(item)
-        else:
-            pointer.append(item)
-    return result
+    flat = kwargs.get("flat", False)
+    reducer = kwargs.get("reducer")
+    if reducer is not None:
+        reducer = _get_reducer(reducer)
+    workers = kwargs.get("workers")
+    if workers:
+        partials = parallel_map(
+            functools.partial(_group_chunk, keys, container, reducer),
+            chunks(iterable, kwargs.get("chunk_size", 10000)),
+            workers=workers,
+            chunk_size=1,
+            backend=kwargs.get("backend", "process"),
+        )
+        groups = merge_groups(partials, reducer)
+        if reducer is None:
+            groups = defaultdict(container, groups)
+    elif reducer is None:
+        groups = _group_items(iterable, _compile_keys(keys), container)
+    else:
+        groups = _reduce_items(iterable, _compile_keys(keys), reducer)
+    if reducer is not None:
+        if kwargs.get("finalize", True):
+            groups = finalize_groups(groups, reducer)
+        container = None
+    if flat or len(keys) == 1:
+        return groups
+    return nest_groups(groups, len(keys), container)
 
 
-_NO_DEFAULT_VALUE_SENTINAL = {}
+def _factorize_columns(columns):
+    """
+    Assign each row of the key columns an integer group code.
+
+    Codes are ordered like the sorted tuples of key values.
+    """
+    codes = np.zeros(len(columns[0]), dtype=np.int64)
+    num_codes = 1
+    for column in columns:
+        uniques, inverse = np.unique(column, return_inverse=True)
+        codes = codes * len(uniques) + inverse.reshape(-1)
+        num_codes *= len(uniques)
+        if num_codes > 2**31:
+            # renumber the codes densely so that they do not overflow
+            uniques, codes = np.unique(codes, return_inverse=True)
+            codes = codes.reshape(-1)
+            num_codes = len(uniques)
+    return codes
+
+
+def _reduce_sorted(reducer, values, starts, ends):
+    """Compute a named aggregate over contiguous groups of sorted values."""
+    counts = ends - starts
+    if reducer == "count":
+        return counts
+    if reducer == "sum":
+        return np.add.reduceat(values, starts)
+    if reducer == "min":
+        return np.minimum.reduceat(values, starts)
+    if reducer == "max":
+        return np.maximum.reduceat(values, starts)
+    if reducer == "first":
+        return values[starts]
+    if reducer == "last":
+        return values[ends - 1]
+    means = np.add.reduceat(values, starts) / counts
+    if reducer == "mean":
+        return means
+    if reducer == "var":
+        deviations = values - np.repeat(means, counts)
+        return np.add.reduceat(deviations * deviations, starts) / counts
+    raise ValueError("unknown reducer {!r}".format(reducer))
+
+
+def groupby_arrays(keys, values=None, reducer=None, flat=False):
+    """
+    Group rows of column arrays by the values of one or more key columns.
+
+    This is a vectorized counterpart to :func:`groupby` for data held
+    in NumPy arrays or pandas Series: rows are grouped with a single
+    stable argsort over integer group codes rather than per-item
+    dictionary lookups.
+
+    Each group maps to an array of the row indices in that group, or,
+    if `values` is given, to the array of values in those rows, or, if
+    `reducer` is given, to an aggregate of those values.  Groups are
+    ordered by key value, and rows within a group keep their order.
+
+    :param keys: a key column, or a list or tuple of key columns
+    :param values: optional, a column of values to group
+    :param reducer: optional, the name of a built-in aggregate ("count",
+        "sum", "min", "max", "first", "last", "mean" or "var"), which is
+        computed vectorized, or a :class:`Reducer` object, which is
+        applied to each group in turn
+    :param bool flat: Defaults to False.  If True, return a flat
+        dictionary keyed on tuples of key values; otherwise nest one
+        dictionary level per key column, like :func:`groupby`.
+    """
+    if (isinstance(keys, (list, tuple))
+            and all(np.ndim(key) >= 1 for key in keys)):
+        columns = [np.asarray(key) for key in keys]
+    else:
+        columns = [np.asarray(keys)]
+    length = len(columns[0])
+    if any(len(column) != length for column in columns):
+        raise ValueError("key columns must all have the same length")
+    if values is not None:
+        values = np.asarray(values)
+        if len(values) != length:
+            raise ValueError("values must have the same length as the keys")
+    elif reducer is not None and reducer != "count":
+        raise ValueError("values must be given to use a reducer")
+    if length == 0:
+        return {}
+    codes = _factorize_columns(columns)
+    order = np.argsort(codes, kind="stable")
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(codes[order])) + 1))
+    ends = np.append(starts[1:], length)
+    first_rows = order[starts]
+    group_keys = [column[first_rows].tolist() for column in columns]
+    group_keys = group_keys[0] if len(columns) == 1 else list(zip(*group_keys))
+    if values is not None:
+        values = values[order]
+    if reducer is None:
+        results = np.split(order if values is None else values, starts[1:])
+    elif isinstance(reducer, string_types):
+        results = _reduce_sorted(reducer, values, starts, ends).tolist()
+    else:
+        results = []
+        for begin, end in zip(starts.tolist(), ends.tolist()):
+            state = reducer.init()
+            for value in values[begin:end].tolist():
+                state = reducer.update(state, value)
+            results.append(reducer.result(state))
+    groups = dict(zip(group_keys, results))
+    if flat or len(columns) == 1:
+        return groups
+    return nest_groups(groups, len(columns))
+
+
+class _SpillFiles:
+    """
+    A set of temporary files holding pickled batches of items.
+
+    Use as a context manager; the files are deleted on exit.  Files
+    are compressed according to `suffix` (see :func:`wkr.io.open_file`).
+    """
+
+    def __init__(self, num_files, directory=None, suffix=".gz"):
+        self._stack = ExitStack()
+        self.names = [
+            self._stack.enter_context(temp_file_name(suffix, directory))
+            for _ in range(num_files)
+        ]
+        self._writers = {}
+        self._written = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+        self._stack.close()
+
+    def write(self, idx, items):
+        """Append the list `items` to the `idx`-th file."""
+        writer = self._writers.get(idx)
+        if writer is None:
+            writer = self._writers[idx] = open_file(self.names[idx], "wb")
+        pickle.dump(items, writer, pickle.HIGHEST_PROTOCOL)
+        self._written.add(idx)
+
+    def read(self, idx):
+        """Yield all items written to the `idx`-th file, in order."""
+        writer = self._writers.pop(idx, None)
+        if writer is not None:
+            writer.close()
+        if idx not in self._written:
+            return
+        with open_file(self.names[idx], "rb") as reader:
+            while True:
+                try:
+                    batch = pickle.load(reader)
+                except EOFError:
+                    return
+                for item in batch:
+                    yield item
+
+
+def groupby_external(iterable, *keys, **kwargs):
+    """
+    Group objects from iterable, spilling to disk if they do not fit in
+    memory.
+
+    This is a generator yielding `(key, group)` pairs, where `key` is
+    the value of the key function, or a tuple of values if several keys
+    are given (as with ``groupby(..., flat=True)``).
+
+    Items are buffered in memory until their estimated size exceeds
+    `memory_budget`.  If that never happens, they are grouped in
+    memory.  Otherwise, the buffer is hash-partitioned on the group key
+    into temporary spill files, and at the end each partition is read
+    back and grouped in turn, so that only one partition at a time
+    needs to fit in memory.  Groups are yielded in no particular order.
+
+    :param iterable iterable: source of objects to sort
+    :param str or callable key: one or more functions to sort the object
+    :param callable container: Defaults to list.
+    :param reducer: optional, see :func:`groupby`
+    :param int memory_budget: approximate number of bytes of items (as
+        measured by `sys.getsizeof`) to buffer before spilling.
+        Defaults to 256 MiB.
+    :param int num_partitions: number of spill files.  Defaults to 64.
+    :param str directory: optional directory for the spill files
+    :param str suffix: suffix of the spill files, selecting the
+        compression used.  Defaults to ".gz".
+    """
+    if not keys:
+        raise TypeError(
+            "groupby_external() missing 1 required positional argument: 'key'"
+        )
+    container = kwargs.get("container", list)
+    reducer = kwargs.get("reducer")
+    memory_budget = kwargs.get("memory_budget", 256 * 1024 * 1024)
+    num_partitions = kwargs.get("num_partitions", 64)
+    keyfunc = _compile_keys(keys)
+    if reducer is not None:
+        reducer = _get_reducer(reducer)
+
+    def group(items):
+        if reducer is None:
+            return _group_items(items, keyfunc, container)
+        return finalize_groups(_reduce_items(items, keyfunc, reducer), reducer)
+
+    def spill(buffer):
+        partitions = [[] for _ in range(num_partitions)]
+        for item in buffer:
+            partitions[hash(keyfunc(item)) % num_partitions].append(item)
+        for idx, partition in enumerate(partitions):
+            if partition:
+                spill_files.write(idx, partition)
+
+    getsizeof = sys.getsizeof
+    spill_files = None
+    with ExitStack() as stack:
+        buffer = []
+        buffer_size = 0
+        for item in iterable:
+            buffer.append(item)
+            buffer_size += getsizeof(item)
+            if buffer_size > memory_budget:
+                if spill_files is None:
+                    spill_files = stack.enter_context(
+                        _SpillFiles(
+                            num_partitions,
+                            kwargs.get("directory"),
+                            kwargs.get("suffix", ".gz"),
+                        )
+                    )
+                spill(buffer)
+                buffer = []
+                buffer_size = 0
+        if spill_files is None:
+            for pair in group(buffer).items():
+                yield pair
+            return
+        spill(buffer)
+        del buffer
+        for idx in range(num_partitions):
+            for pair in group(spill_files.read(idx)).items():
+                yield pair
 
 
 def first(pred, seq, default=_NO_DEFAULT_VALUE_SENTINAL):
@@ -224,39 +1306,599 @@ def humanise_bytes(num_bytes, si=False):
     return "{:.1f} {}B".format(num_bytes / math.pow(unit, exp), pre)
 
 
-def shuffled(iterable):
-    """Returns a list containing the values of `iterable` in random order."""
+class _GlobalRandom:
+    """Picklable stand-in for the functions of the `random` module."""
+
+    __slots__ = ()
+
+    def random(self):
+        return random.random()
+
+    def randrange(self, n):
+        return random.randrange(n)
+
+    def betavariate(self, alpha, beta):
+        return random.betavariate(alpha, beta)
+
+    def shuffle(self, x):
+        random.shuffle(x)
+
+
+class BatchedRandom:
+    """
+    Random number source backed by a NumPy Generator.
+
+    Uniform random numbers are drawn from the generator in vectorized
+    blocks of `batch_size` and served one at a time, which is much
+    faster than calling the generator for every number.  This class
+    provides the part of the `random.Random` interface used by wkr's
+    samplers: `random`, `randrange`, `betavariate` and `shuffle`.
+
+    :param generator: a `numpy.random.Generator`, or a seed to create
+        one with `numpy.random.default_rng`
+    :param int batch_size: Defaults to 4096.
+    """
+
+    __slots__ = ("generator", "batch_size", "_block")
+
+    def __init__(self, generator=None, batch_size=4096):
+        self.generator = np.random.default_rng(generator)
+        self.batch_size = batch_size
+        self._block = []
+
+    def random(self):
+        try:
+            return self._block.pop()
+        except IndexError:
+            self._block = self.generator.random(self.batch_size).tolist()
+            return self._block.pop()
+
+    def randrange(self, n):
+        return min(int(self.random() * n), n - 1)
+
+    def betavariate(self, alpha, beta):
+        return float(self.generator.beta(alpha, beta))
+
+    def shuffle(self, x):
+        x[:] = [x[idx] for idx in self.generator.permutation(len(x)).tolist()]
+
+
+_GLOBAL_RANDOM = _GlobalRandom()
+
+
+def _random_source(rng):
+    """
+    Normalize an `rng` argument.
+
+    None stands for the global `random` module, and NumPy Generators
+    are wrapped in :class:`BatchedRandom`; anything else is assumed to
+    behave like `random.Random`.
+    """
+    if rng is None:
+        return _GLOBAL_RANDOM
+    if np is not None and isinstance(rng, np.random.Generator):
+        return BatchedRandom(rng)
+    return rng
+
+
+def shuffled(iterable, rng=None, buffer_size=None):
+    """
+    Returns a list containing the values of `iterable` in random order.
+
+    If `buffer_size` is given, this instead returns a generator doing
+    an approximate shuffle in bounded memory: items pass through a
+    buffer of `buffer_size` items, and each incoming item replaces a
+    randomly chosen buffered one, which is yielded.  Items can thus
+    only move forward by about `buffer_size` places; use
+    :func:`external_shuffled` for an exact shuffle of large inputs.
+
+    :param iterable iterable:
+    :param rng: optional, a `random.Random` instance or a
+        `numpy.random.Generator`.  Defaults to the `random` module.
+    :param int buffer_size: optional, see above
+    """
+    rng = _random_source(rng)
+    if buffer_size is not None:
+        if buffer_size <= 0:
+            raise ValueError("buffer_size must be a positive integer")
+        return _buffered_shuffle(iterable, buffer_size, rng)
     list_val = list(iterable)
-    random.shuffle(list_val)
+    rng.shuffle(list_val)
     return list_val
 
 
+def _buffered_shuffle(iterable, buffer_size, rng):
+    """Generator implementing `shuffled` with a bounded buffer."""
+    iterator = iter(iterable)
+    buffer = list(islice(iterator, buffer_size))
+    randrange = rng.randrange
+    for item in iterator:
+        idx = randrange(buffer_size)
+        yield buffer[idx]
+        buffer[idx] = item
+    rng.shuffle(buffer)
+    for item in buffer:
+        yield item
+
+
+def external_shuffled(
+    iterable, num_buckets=64, rng=None, directory=None, suffix=".gz",
+    batch_size=1024,
+):
+    """
+    Shuffle an iterable too large to fit in memory.
+
+    This is a generator yielding the items of `iterable` in uniformly
+    random order.  Each item is first scattered into one of
+    `num_buckets` temporary files chosen at random; then each bucket
+    in turn is read back, shuffled in memory, and yielded.  Only one
+    bucket (about 1 / `num_buckets` of the input) needs to fit in
+    memory at a time.
+
+    :param iterable iterable:
+    :param int num_buckets: Defaults to 64.
+    :param rng: optional, see :func:`shuffled`
+    :param str directory: optional directory for the temporary files
+    :param str suffix: suffix of the temporary files, selecting the
+        compression used.  Defaults to ".gz".
+    :param int batch_size: number of items buffered per bucket before
+        they are written out.  Defaults to 1024.
+    """
+    rng = _random_source(rng)
+    randrange = rng.randrange
+    with _SpillFiles(num_buckets, directory, suffix) as buckets:
+        pending = [[] for _ in range(num_buckets)]
+        for item in iterable:
+            idx = randrange(num_buckets)
+            bucket = pending[idx]
+            bucket.append(item)
+            if len(bucket) >= batch_size:
+                buckets.write(idx, bucket)
+                pending[idx] = []
+        for idx in range(num_buckets):
+            items = list(buckets.read(idx))
+            items.extend(pending[idx])
+            pending[idx] = None
+            rng.shuffle(items)
+            for item in items:
+                yield item
+
+
+def _count_consumed(iterator, n=None):
+    """
+    Advance `iterator` by `n` items (or to the end, if `n` is None).
+
+    Returns the number of items actually consumed, without any
+    per-item work at Python level.
+    """
+    counter = itertools.count()
+    deque(zip(islice(iterator, n), counter), maxlen=0)
+    return next(counter)
+
+
+def _algorithm_l_step(n, log_w, rng, eps=sys.float_info.epsilon):
+    """
+    Advance the state of Algorithm L after an item entered a reservoir.
+
+    `log_w` is the logarithm of the algorithm's variable W for a
+    reservoir of size `n`; 0.0 for a reservoir that has just filled up.
+    Returns the new `log_w` and the number of items to skip before the
+    next one enters the reservoir.
+    """
+    log_w += math.log(max(rng.random(), eps)) / n
+    # log(1 - W), computed stably for W close to 1
+    log_1mw = math.log(-math.expm1(log_w))
+    return log_w, math.floor(math.log(max(rng.random(), eps)) / log_1mw)
+
+
 class ReservoirSampler:
     """
-    https://en.wikipedia.org/wiki/Reservoir_sampling#Simple:_Algorithm_R
+    Keeps a uniform random sample of `n` items from a stream.
+
+    Implements Algorithm L, which draws the number of items to skip
+    before the next one enters the reservoir, so that only O(n
+    log(N/n)) random numbers are needed for a stream of N items.
+
+    https://en.wikipedia.org/wiki/Reservoir_sampling#Optimal:_Algorithm_L
+
+    :param int n: the sample size
+    :param rng: optional, a `random.Random` instance or a
+        `numpy.random.Generator` (used through :class:`BatchedRandom`).
+        Defaults to the `random` module.
     """
 
+    __slots__ = (
+        "n",
+        "rng",
+        "samples",
+        "num_observations",
+        "_log_w",
+        "_next_index",
+    )
+
     eps = sys.float_info.epsilon
 
-    def __init__(self, n: int):
+    def __init__(self, n: int, rng: Any = None):
         self.n = n
+        self.rng = _random_source(rng)
         self.samples = []
         self.num_observations = 0
+        # the logarithm of Algorithm L's W, and the (1-based) number of
+        # the next observation that will enter the reservoir
+        self._log_w = 0.0
+        self._next_index = math.inf
+
+    def _advance(self) -> None:
+        self._log_w, skip = _algorithm_l_step(
+            self.n, self._log_w, self.rng, self.eps
+        )
+        self._next_index += skip + 1
 
     def observe(self, item: Any) -> None:
         self.num_observations += 1
-        # fill the reservoir
-        if len(self.samples) < self.n:
+        if self.num_observations == self._next_index:
+            self.samples[self.rng.randrange(self.n)] = item
+            self._advance()
+        elif len(self.samples) < self.n:
+            # fill the reservoir
             self.samples.append(item)
+            if len(self.samples) == self.n:
+                self._next_index = self.num_observations
+                self._advance()
+
+    def observe_many(self, iterable: Iterable[Any]) -> None:
+        """
+        Observe all items of `iterable`.
+
+        Skipped items of sequences and NumPy arrays are never touched;
+        those of other iterables are consumed without per-item Python
+        work.
+        """
+        if (isinstance(iterable, collections.abc.Sequence)
+                or _is_ndarray(iterable)):
+            self._observe_sequence(iterable)
+            return
+        iterator = iter(iterable)
+        if len(self.samples) < self.n:
+            for item in iterator:
+                self.observe(item)
+                if len(self.samples) == self.n:
+                    break
+        marker = object()
+        while True:
+            if self._next_index == math.inf:
+                self.num_observations += _count_consumed(iterator)
+                return
+            skip = self._next_index - self.num_observations - 1
+            skipped = _count_consumed(iterator, skip)
+            self.num_observations += skipped
+            if skipped < skip:
+                return
+            item = next(iterator, marker)
+            if item is marker:
+                return
+            self.observe(item)
+
+    def _observe_sequence(self, seq) -> None:
+        start = self.num_observations
+        total = len(seq)
+        pos = 0
+        while len(self.samples) < self.n and pos < total:
+            self.observe(seq[pos])
+            pos += 1
+        while True:
+            pos = self._next_index - start - 1
+            if pos >= total:
+                break
+            self.num_observations = self._next_index - 1
+            self.observe(seq[pos])
+        self.num_observations = start + total
+
+    def merge(self, other: "ReservoirSampler") -> "ReservoirSampler":
+        """
+        Combine this reservoir with one kept over a disjoint stream.
+
+        Returns a new sampler holding a uniform sample of the union of
+        both streams, which can go on observing items.
+        """
+        if other.n != self.n:
+            raise ValueError("cannot merge reservoirs of different sizes")
+        merged = ReservoirSampler(self.n, self.rng)
+        rng = merged.rng
+        merged.num_observations = (
+            self.num_observations + other.num_observations
+        )
+        # draw without replacement from the union, choosing each side
+        # in proportion to the number of its items not yet drawn
+        left = shuffled(self.samples, rng)
+        right = shuffled(other.samples, rng)
+        num_left = self.num_observations
+        num_right = other.num_observations
+        for _ in range(min(self.n, merged.num_observations)):
+            if rng.random() * (num_left + num_right) < num_left:
+                merged.samples.append(left.pop())
+                num_left -= 1
+            else:
+                merged.samples.append(right.pop())
+                num_right -= 1
+        if self.n > 0 and len(merged.samples) == self.n:
+            # in Algorithm L, W is distributed as the n-th smallest of
+            # num_observations uniform variates
+            w = rng.betavariate(self.n, merged.num_observations - self.n + 1)
+            merged._log_w = math.log(max(w, self.eps))
+            skip = math.floor(
+                math.log(max(rng.random(), self.eps))
+                / math.log(-math.expm1(merged._log_w))
+            )
+            merged._next_index = merged.num_observations + skip + 1
+        return merged
+
+    @staticmethod
+    def sample(n: int, iterable: Iterable[Any], rng: Any = None) -> List[Any]:
+        reservoir = ReservoirSampler(n, rng)
+        reservoir.observe_many(iterable)
+        return reservoir.samples
+
+
+class WeightedReservoirSampler:
+    """
+    Keeps a weighted random sample of `n` items from a stream, without
+    replacement.
+
+    Implements A-ExpJ (Efraimidis and Spirakis): each item is given the
+    key u ** (1 / weight) for a uniform random u, and the reservoir
+    holds the `n` items with the largest keys.  Exponential jumps skip
+    over items that cannot enter the reservoir, so that random numbers
+    are drawn only for the items that do.  Keys are stored as their
+    logarithms for numerical stability.
+
+    https://en.wikipedia.org/wiki/Reservoir_sampling#Algorithm_A-ExpJ
+
+    :param int n: the sample size
+    :param rng: optional, see :class:`ReservoirSampler`
+    """
+
+    __slots__ = ("n", "rng", "num_observations", "_heap", "_jump")
+
+    eps = sys.float_info.epsilon
+
+    def __init__(self, n: int, rng: Any = None):
+        self.n = n
+        self.rng = _random_source(rng)
+        self.num_observations = 0
+        # min-heap of (log key, observation number, item)
+        self._heap = []
+        # the total weight still to be skipped
+        self._jump = math.inf
+
+    @property
+    def samples(self) -> List[Any]:
+        return [item for _key, _num, item in self._heap]
+
+    def _new_jump(self) -> None:
+        log_threshold = min(self._heap[0][0], -sys.float_info.min)
+        self._jump = math.log(max(self.rng.random(), self.eps)) / log_threshold
+
+    def observe(self, item: Any, weight: float) -> None:
+        self.num_observations += 1
+        if weight <= 0:
+            if weight < 0:
+                raise ValueError("weights must not be negative")
             return
-        # replace elements with gradually decreasing probability
-        j = random.randint(1, self.num_observations)
-        if j <= self.n:
-            self.samples[j - 1] = item
+        heap = self._heap
+        if len(heap) < self.n:
+            key = math.log(max(self.rng.random(), self.eps)) / weight
+            heapq.heappush(heap, (key, self.num_observations, item))
+            if len(heap) == self.n:
+                self._new_jump()
+            return
+        self._jump -= weight
+        if self._jump > 0:
+            return
+        # the new key is drawn from the part of the key distribution
+        # above the current threshold
+        threshold = math.exp(heap[0][0] * weight)
+        u = threshold + (1.0 - threshold) * self.rng.random()
+        key = math.log(max(u, sys.float_info.min)) / weight
+        heapq.heapreplace(heap, (key, self.num_observations, item))
+        self._new_jump()
+
+    def observe_many(self, pairs: Iterable[Any]) -> None:
+        """Observe all `(item, weight)` pairs of `pairs`."""
+        for item, weight in pairs:
+            self.observe(item, weight)
+
+    def merge(
+        self, other: "WeightedReservoirSampler"
+    ) -> "WeightedReservoirSampler":
+        """
+        Combine this reservoir with one kept over a disjoint stream.
+
+        Returns a new sampler holding a weighted sample of the union of
+        both streams, which can go on observing items.
+        """
+        if other.n != self.n:
+            raise ValueError("cannot merge reservoirs of different sizes")
+        merged = WeightedReservoirSampler(self.n, self.rng)
+        merged.num_observations = (
+            self.num_observations + other.num_observations
+        )
+        merged._heap = heapq.nlargest(self.n, self._heap + other._heap)
+        heapq.heapify(merged._heap)
+        if merged._heap and len(merged._heap) == self.n:
+            merged._new_jump()
+        return merged
 
     @staticmethod
-    def sample(n: int, iterable: Iterable[Any]) -> List[Any]:
-        reservoir = ReservoirSampler(n)
+    def sample(n: int, pairs: Iterable[Any], rng: Any = None) -> List[Any]:
+        reservoir = WeightedReservoirSampler(n, rng)
+        reservoir.observe_many(pairs)
+        return reservoir.samples
+
+
+class _StratifiedSampler:
+    """
+    Common storage for samplers keeping one reservoir per stratum.
+
+    The reservoirs of all strata live in a single dictionary mapping
+    each stratum's key to a compact state list.
+    """
+
+    __slots__ = ("n", "key", "rng", "num_observations", "_strata")
+
+    eps = sys.float_info.epsilon
+
+    def __init__(self, n: int, key: Any = None, rng: Any = None):
+        self.n = n
+        self.key = None if key is None else _compile_key(key)
+        self.rng = _random_source(rng)
+        self.num_observations = 0
+        self._strata = {}
+
+    def _stratum_samples(self, state: List[Any]) -> List[Any]:
+        raise NotImplementedError
+
+    @property
+    def samples(self) -> dict:
+        """A dictionary mapping each stratum's key to its sample."""
+        return {
+            key: self._stratum_samples(state)
+            for key, state in self._strata.items()
+        }
+
+
+class StratifiedReservoirSampler(_StratifiedSampler):
+    """
+    Keeps a uniform random sample of `n` items from each stratum of a
+    stream.
+
+    Strata are defined by `key`, a function (or item key string) as
+    used by :func:`groupby`.  Each stratum is sampled with Algorithm L,
+    like :class:`ReservoirSampler`, with its state held as a list
+    `[num_observations, next_index, log_w, samples]`.
+
+    :param int n: the sample size per stratum
+    :param key: function or item key string giving an item's stratum
+    :param rng: optional, see :class:`ReservoirSampler`
+    """
+
+    __slots__ = ()
+
+    def __init__(self, n: int, key: Any, rng: Any = None):
+        super().__init__(n, key, rng)
+
+    def _stratum_samples(self, state: List[Any]) -> List[Any]:
+        return state[3]
+
+    def _advance(self, state: List[Any]) -> None:
+        state[2], skip = _algorithm_l_step(
+            self.n, state[2], self.rng, self.eps
+        )
+        state[1] += skip + 1
+
+    def observe(self, item: Any) -> None:
+        self.observe_many((item,))
+
+    def observe_many(self, iterable: Iterable[Any]) -> None:
+        """Observe all items of `iterable`."""
+        n = self.n
+        strata = self._strata
+        keyfunc = self.key
+        randrange = self.rng.randrange
+        num_observations = 0
         for item in iterable:
-            reservoir.observe(item)
+            num_observations += 1
+            key = keyfunc(item)
+            try:
+                state = strata[key]
+            except KeyError:
+                state = strata[key] = [0, math.inf, 0.0, []]
+            state[0] += 1
+            if state[0] == state[1]:
+                state[3][randrange(n)] = item
+                self._advance(state)
+            elif len(state[3]) < n:
+                state[3].append(item)
+                if len(state[3]) == n:
+                    state[1] = state[0]
+                    self._advance(state)
+        self.num_observations += num_observations
+
+    @staticmethod
+    def sample(
+        n: int, key: Any, iterable: Iterable[Any], rng: Any = None
+    ) -> dict:
+        reservoir = StratifiedReservoirSampler(n, key, rng)
+        reservoir.observe_many(iterable)
         return reservoir.samples
+
+
+class DecayedReservoirSampler(_StratifiedSampler):
+    """
+    Keeps an exponentially time-decayed random sample of `n` items from
+    each stratum of a stream.
+
+    An item observed at time `t` is sampled with weight proportional to
+    2 ** (t / half_life), so that recent items are preferred.  Each
+    item gets the priority `rate * t - log(-log(u))` for a uniform
+    random `u`, which ranks items like the A-Res key u ** (1 / weight)
+    without overflowing for large `t`; each stratum keeps a min-heap of
+    the `n` items with the highest priorities.
+
+    :param int n: the sample size per stratum
+    :param float half_life: the time over which an item's weight halves
+    :param key: optional, function or item key string giving an item's
+        stratum.  By default, all items fall into the stratum None.
+    :param rng: optional, see :class:`ReservoirSampler`
+    """
+
+    __slots__ = ("rate",)
+
+    def __init__(
+        self, n: int, half_life: float, key: Any = None, rng: Any = None
+    ):
+        super().__init__(n, key, rng)
+        self.rate = math.log(2) / half_life
+
+    def _stratum_samples(self, state: List[Any]) -> List[Any]:
+        return [item for _priority, _num, item in state]
+
+    def observe(self, item: Any, timestamp: float = None) -> None:
+        """
+        Observe `item` at time `timestamp`.
+
+        The time defaults to the number of items observed so far.
+        """
+        self.num_observations += 1
+        if timestamp is None:
+            timestamp = self.num_observations
+        key = None if self.key is None else self.key(item)
+        try:
+            heap = self._strata[key]
+        except KeyError:
+            heap = self._strata[key] = []
+        u = max(self.rng.random(), self.eps)
+        entry = (
+            self.rate * timestamp - math.log(-math.log(u)),
+            self.num_observations,
+        )
+        if len(heap) < self.n:
+            heapq.heappush(heap, entry + (item,))
+        elif entry > heap[0][:2]:
+            heapq.heapreplace(heap, entry + (item,))
+
+    def observe_many(
+        self, iterable: Iterable[Any], timestamps: Any = None
+    ) -> None:
+        """
+        Observe all items of `iterable`.
+
+        :param iterable timestamps: optional, the times at which the
+            items were observed
+        """
+        if timestamps is None:
+            for item in iterable:
+                self.observe(item)
+        else:
+            for item, timestamp in zip(iterable, timestamps):
+                self.observe(item, timestamp)
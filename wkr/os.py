@@ -17,10 +17,16 @@ import errno
 import os
 import shutil
 import tempfile
+import time
 from contextlib import contextmanager
 
 import wkr.io
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 
 def mkdir_p(path):
     """Functionality similar to mkdir -p."""
@@ -88,6 +94,55 @@ def open_atomic(filepath, mode='w+b', fsync=False, **kwargs):
         os.rename(tmppath, filepath)
 
 
+@contextmanager
+def file_lock(path, poll_interval=0.05, remove=False):
+    """
+    Context manager holding an exclusive lock on the lock file `path`.
+
+    Blocks until the lock is acquired.  Uses `flock` where available,
+    so that the lock is released even if the holding process dies;
+    elsewhere, the lock is held by creating `path` exclusively, and
+    the file is always deleted on leaving.
+
+    With `remove`, the lock file is also deleted on leaving when using
+    `flock`.  Processes already waiting for the lock then acquire the
+    deleted file, and so are no longer excluded from newcomers, so
+    only use this where the locked work is merely wasted if repeated.
+
+    :param str path: the lock file
+    :param float poll_interval: seconds to wait between attempts to
+        acquire the lock, when `flock` is not available
+    :param bool remove: whether to delete the lock file on leaving
+    """
+    if fcntl is not None:
+        with open(path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if remove:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        return
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            time.sleep(poll_interval)
+        else:
+            break
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
 def backup_file(filename):
     """Back up the old file, if it exists."""
     if os.path.exists(filename):
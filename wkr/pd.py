@@ -10,32 +10,735 @@ pd.py
 from __future__ import absolute_import
 
 import collections
+import functools
+import glob
+import hashlib
+import inspect
+import itertools
+import json
+import operator
+import os
+import pickle
+import re
 
+import numpy as np
 import pandas as pd
 
+from . import chunks, parallel_map
+from .io import open_file
+from .os import file_lock, open_atomic
 
-def pandas_memoize_csv(csv_filename, **kwds):
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = feather = pq = None
+
+PANDAS_MEMOIZE_FORMATS = ("parquet", "feather", "pickle", "csv")
+
+_FORMAT_EXTENSIONS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+    ".pkl": "pickle",
+    ".pickle": "pickle",
+    ".csv": "csv",
+}
+
+_FORMAT_MAGIC = [
+    (b"PAR1", "parquet"),
+    (b"ARROW1", "feather"),
+    (b"FEA1", "feather"),
+    (b"\x80", "pickle"),
+]
+
+_COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zip": "zip"
+}
+
+
+def _infer_format(path):
+    """Guess the cache format from the file name `path`."""
+    name = str(path).lower()
+    for extension in _COMPRESSION_EXTENSIONS:
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+    return _FORMAT_EXTENSIONS.get(os.path.splitext(name)[1], "parquet")
+
+
+def _infer_compression(path):
+    """Guess the compression of the file `path` from its extension."""
+    name = str(path).lower()
+    for extension, compression in _COMPRESSION_EXTENSIONS.items():
+        if name.endswith(extension):
+            return compression
+    return None
+
+
+def _sniff_format(path, default):
     """
-    Memoize the pandas DataFrame result of a function to a CSV file.
+    Determine the format of the existing cache file `path`.
 
-    :param str csv_filename:
-    :param dict kwds: passed to the pd.read_csv function
+    Files without the magic number of a binary format are assumed to
+    be CSV when a columnar format was expected, so that caches written
+    by `pandas_memoize_csv` can still be read.
+    """
+    with open(path, "rb") as input_file:
+        head = input_file.read(6)
+    for magic, fmt in _FORMAT_MAGIC:
+        if head.startswith(magic):
+            return fmt
+    if default in ("parquet", "feather"):
+        return "csv"
+    return default
+
+
+def _read_frame(path, fmt, memory_map=False, **kwds):
+    """Load a DataFrame from the cache file `path` in format `fmt`."""
+    if fmt == "parquet":
+        return pd.read_parquet(path, memory_map=memory_map, **kwds)
+    if fmt == "feather":
+        if feather is None:
+            raise ImportError("pyarrow is required for the feather format")
+        table = feather.read_table(path, memory_map=memory_map, **kwds)
+        return table.to_pandas()
+    if fmt == "pickle":
+        return pd.read_pickle(path, **kwds)
+    return pd.read_csv(
+        path, encoding="utf-8", index_col=0, memory_map=memory_map, **kwds
+    )
+
+
+def _write_frame(df, path, fmt):
+    """
+    Store the DataFrame `df` to the cache file `path` in format `fmt`.
+
+    The file is written atomically, so that concurrent readers never
+    see a partially written cache.  The index is always stored as a
+    column, even a `RangeIndex`, so that the rows of a cache read in
+    parts keep their labels.
+    """
+    if fmt == "feather" and feather is None:
+        raise ImportError("pyarrow is required for the feather format")
+    # the temporary file has no extension, so pandas cannot infer this
+    compression = _infer_compression(path)
+    with open_atomic(path, "wb") as output_file:
+        if fmt == "parquet":
+            df.to_parquet(output_file, index=True)
+        elif fmt == "feather":
+            table = pa.Table.from_pandas(df, preserve_index=True)
+            feather.write_feather(table, output_file)
+        elif fmt == "pickle":
+            df.to_pickle(output_file, compression=compression)
+        else:
+            df.to_csv(output_file, encoding="utf-8", compression=compression)
+
+
+def _compact_series(series, categorical_threshold):
+    """Convert `series` to the most compact dtype that loses nothing."""
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or series.isna().all():
+        return series
+    if pd.api.types.is_integer_dtype(dtype):
+        return pd.to_numeric(series, downcast="integer")
+    if pd.api.types.is_float_dtype(dtype):
+        if dtype.itemsize <= 4:
+            return series
+        # keep missing values of nullable floats as pd.NA
+        if isinstance(dtype, pd.Float64Dtype):
+            downcast = series.astype("Float32")
+        elif isinstance(dtype, np.dtype):
+            downcast = series.astype("float32")
+        else:
+            return series
+        if np.array_equal(
+            downcast.to_numpy(dtype="float64", na_value=np.nan),
+            series.to_numpy(dtype="float64", na_value=np.nan),
+            equal_nan=True,
+        ):
+            return downcast
+        return series
+    is_text = (pd.api.types.is_object_dtype(dtype)
+               or pd.api.types.is_string_dtype(dtype))
+    if is_text and not isinstance(dtype, pd.CategoricalDtype):
+        if pd.api.types.infer_dtype(series, skipna=True) != "string":
+            return series
+        if series.nunique() <= categorical_threshold * len(series):
+            return series.astype("category")
+    return series
+
+
+def compact(df, categorical_threshold=0.5, return_savings=False):
+    """
+    Convert the columns of `df` to more compact dtypes.
+
+    Integer columns are downcast to the smallest signed integer type
+    that holds their values (never to an unsigned type, on which
+    subtraction could silently wrap around); float columns are
+    downcast to float32 (Float32 for nullable floats) when this does
+    not change any value; and string columns with at most
+    `categorical_threshold` distinct values per row are converted to
+    categoricals.  Other columns are left alone.
+
+    :param pd.DataFrame df: the DataFrame
+    :param float categorical_threshold: the maximum ratio of distinct
+        values to rows for a string column to become categorical
+    :param bool return_savings: whether to also return the number of
+        bytes saved
+    :return: the compacted DataFrame, or a tuple of the compacted
+        DataFrame and the number of bytes saved
+    """
+    result = df.copy(deep=False)
+    for idx in range(len(df.columns)):
+        result.isetitem(
+            idx, _compact_series(df.iloc[:, idx], categorical_threshold)
+        )
+    if not return_savings:
+        return result
+    savings = int(
+        df.memory_usage(deep=True).sum() - result.memory_usage(deep=True).sum()
+    )
+    return result, savings
+
+
+_FILTER_OPERATORS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda series, values: series.isin(values),
+    "not in": lambda series, values: ~series.isin(values),
+}
+
+
+def _normalize_filters(filters):
+    """
+    Bring `filters` into disjunctive normal form.
+
+    Filters use the convention of `pyarrow.parquet`: a list of
+    `(column, op, value)` tuples which must all hold, or a list of
+    such lists, of which at least one must hold.
+    """
+    if not filters:
+        return []
+    if isinstance(filters[0], tuple):
+        return [filters]
+    return filters
+
+
+def _apply_filters(df, filters):
+    """Select the rows of `df` matching `filters`; see `_normalize_filters`."""
+    filters = _normalize_filters(filters)
+    if not filters:
+        return df
+    mask = None
+    for conjunction in filters:
+        conjunction_mask = pd.Series(True, index=df.index)
+        for column, op, value in conjunction:
+            if column in df.columns:
+                series = df[column]
+            else:
+                series = pd.Series(
+                    df.index.get_level_values(column), index=df.index
+                )
+            match = _FILTER_OPERATORS[op](series, value)
+            conjunction_mask &= match.fillna(False).astype(bool)
+        mask = conjunction_mask if mask is None else mask | conjunction_mask
+    return df[mask.to_numpy()]
+
+
+def _arrow_index_columns(schema):
+    """Find the names of the stored index columns of an Arrow schema."""
+    metadata = schema.pandas_metadata or {}
+    return [
+        column
+        for column in metadata.get("index_columns", [])
+        if isinstance(column, str)
+    ]
+
+
+class LazyFrame(object):
+    """
+    A handle on a memoized DataFrame, which is only loaded on demand.
+
+    Columns can be projected and rows filtered while loading.  With
+    the parquet format, both are pushed down into the reader, so that
+    only the needed parts of the file are read; with feather, only
+    the needed columns are read (from a memory map).  Pickle caches
+    are always loaded in full.
+
+    Filters use the convention of `pyarrow.parquet`, e.g.
+    `[("year", ">=", 2020), ("country", "in", ["DE", "FR"])]`.
+    """
+
+    def __init__(self, path, format, memory_map=False, **kwds):
+        """
+        Constructor.
+
+        :param str path: the cache file
+        :param str format: the format the cache file is written in
+        :param bool memory_map: whether to memory-map the file on loading
+        :param dict kwds: passed to the function reading the cache file
+        """
+        self.path = path
+        self.format = format
+        self.memory_map = memory_map
+        self.kwds = kwds
+
+    def __repr__(self):
+        return "LazyFrame({!r}, format={!r})".format(self.path, self.format)
+
+    def _arrow_schema(self):
+        if pq is None:
+            raise ImportError(
+                "pyarrow is required to inspect {} files".format(self.format)
+            )
+        if self.format == "parquet":
+            return pq.read_schema(self.path)
+        return feather.read_table(self.path, memory_map=True).schema
+
+    @property
+    def columns(self):
+        """The names of the columns of the DataFrame, without loading it."""
+        if self.format in ("parquet", "feather"):
+            schema = self._arrow_schema()
+            index_columns = _arrow_index_columns(schema)
+            return [name for name in schema.names if name not in index_columns]
+        if self.format == "csv":
+            return self._read_csv(nrows=0).columns.tolist()
+        return self.load().columns.tolist()
+
+    def _needed_columns(self, columns, filters):
+        """List the columns to read to project `columns` after `filters`."""
+        if columns is None:
+            return None
+        needed = list(columns)
+        for conjunction in _normalize_filters(filters):
+            for column, _op, _value in conjunction:
+                if column not in needed:
+                    needed.append(column)
+        return needed
+
+    def _read_csv(self, columns=None, **kwds):
+        kwds = dict(self.kwds, **kwds)
+        if columns is not None:
+            header = self._read_csv(nrows=0)
+            # keep the index column, which may well be unnamed
+            kwds["usecols"] = [0] + [
+                header.columns.get_loc(column) + 1
+                for column in columns
+                if column in header.columns
+            ]
+        return pd.read_csv(
+            self.path, encoding="utf-8", index_col=0,
+            memory_map=self.memory_map, **kwds
+        )
+
+    def _read_arrow(self, columns):
+        """Read a feather file as an Arrow table, keeping its index."""
+        if columns is not None:
+            schema = self._arrow_schema()
+            columns = list(columns) + _arrow_index_columns(schema)
+        return feather.read_table(
+            self.path, columns=columns, memory_map=self.memory_map, **self.kwds
+        )
+
+    def _project(self, df, columns, filters):
+        df = _apply_filters(df, filters)
+        if columns is not None:
+            df = df[list(columns)]
+        return df
+
+    def load(self, columns=None, filters=None):
+        """
+        Load the DataFrame.
+
+        :param list columns: optional, the columns to load
+        :param list filters: optional, row filters to apply
+        """
+        if self.format == "parquet":
+            return pd.read_parquet(
+                self.path,
+                columns=columns,
+                filters=_normalize_filters(filters) or None,
+                memory_map=self.memory_map,
+                **self.kwds,
+            )
+        needed = self._needed_columns(columns, filters)
+        if self.format == "feather":
+            df = self._read_arrow(needed).to_pandas()
+        elif self.format == "csv":
+            df = self._read_csv(needed)
+        else:
+            df = pd.read_pickle(self.path, **self.kwds)
+        return self._project(df, columns, filters)
+
+    def iter_chunks(self, chunksize, columns=None, filters=None):
+        """
+        Load the DataFrame piece by piece.
+
+        Yields DataFrames of at most `chunksize` rows (fewer if
+        `filters` are given), so that the whole DataFrame never needs
+        to fit in memory.  Pickle caches are loaded in full and then
+        sliced.
+
+        :param int chunksize: the number of rows to read at a time
+        :param list columns: optional, the columns to load
+        :param list filters: optional, row filters to apply
+        """
+        needed = self._needed_columns(columns, filters)
+        if self.format == "parquet":
+            if pq is None:
+                raise ImportError(
+                    "pyarrow is required to read parquet files in chunks"
+                )
+            parquet_file = pq.ParquetFile(
+                self.path, memory_map=self.memory_map
+            )
+            if needed is not None:
+                schema = parquet_file.schema_arrow
+                needed = needed + _arrow_index_columns(schema)
+            chunks = (
+                batch.to_pandas()
+                for batch in parquet_file.iter_batches(
+                    batch_size=chunksize, columns=needed
+                )
+            )
+        elif self.format == "feather":
+            table = self._read_arrow(needed)
+            chunks = (
+                table.slice(offset, chunksize).to_pandas()
+                for offset in range(0, table.num_rows, chunksize)
+            )
+        elif self.format == "csv":
+            chunks = self._read_csv(needed, chunksize=chunksize)
+        else:
+            df = pd.read_pickle(self.path, **self.kwds)
+            chunks = (
+                df.iloc[offset:offset + chunksize]
+                for offset in range(0, len(df), chunksize)
+            )
+        for chunk in chunks:
+            yield self._project(chunk, columns, filters)
+
+
+def _dtype_metadata(dtype):
+    """Describe `dtype` for `frame_digest`, including its categories."""
+    if isinstance(dtype, pd.CategoricalDtype):
+        # the values are hashed, not the codes, which depend on these
+        return [str(dtype), dtype.ordered, frame_digest(dtype.categories)]
+    return str(dtype)
+
+
+def frame_digest(obj, sample=None):
+    """
+    Compute a hex digest of the contents of a DataFrame, Series or Index.
+
+    The digest covers the shape, the column names, the dtypes
+    (including the categories of categorical dtypes), the index and
+    the values, which are hashed column by column with
+    `pd.util.hash_pandas_object` instead of being serialized.  Columns
+    of unhashable objects (such as dictionaries) are pickled instead.
+
+    With `sample`, only that many evenly spaced rows are hashed (along
+    with the shape), which is much faster for huge frames, but misses
+    changes to the other rows.
+
+    :param obj: the DataFrame, Series or Index
+    :param int sample: optional, the number of rows to hash
+    """
+    digest = hashlib.sha1()
+    metadata = [type(obj).__name__, obj.shape]
+    if isinstance(obj, pd.DataFrame):
+        metadata.append(
+            [
+                (repr(name), _dtype_metadata(dtype))
+                for name, dtype in obj.dtypes.items()
+            ]
+        )
+    else:
+        metadata.extend([repr(obj.name), _dtype_metadata(obj.dtype)])
+    if not isinstance(obj, pd.Index):
+        metadata.extend(
+            [repr(obj.index.names), _dtype_metadata(obj.index.dtype)]
+        )
+    digest.update(repr(metadata).encode("utf-8"))
+    if sample is not None and len(obj) > sample:
+        obj = obj.take(np.linspace(0, len(obj) - 1, sample).astype(np.intp))
+    try:
+        hashes = pd.util.hash_pandas_object(obj, index=True)
+    except TypeError:
+        digest.update(pickle.dumps(obj, protocol=4))
+    else:
+        digest.update(np.ascontiguousarray(hashes).tobytes())
+    return digest.hexdigest()
+
+
+def _update_digest(digest, obj):
+    """Feed a canonical serialization of `obj` into a hashlib digest."""
+    digest.update(type(obj).__name__.encode("utf-8"))
+    if isinstance(obj, (list, tuple)):
+        digest.update(b"[")
+        for item in obj:
+            _update_digest(digest, item)
+        digest.update(b"]")
+    elif isinstance(obj, dict):
+        # hash the items in an order that does not depend on insertion
+        digest.update(b"{")
+        for item_digest in sorted(_digest(item) for item in obj.items()):
+            digest.update(item_digest)
+        digest.update(b"}")
+    elif isinstance(obj, (set, frozenset)):
+        digest.update(b"{")
+        for item_digest in sorted(_digest(item) for item in obj):
+            digest.update(item_digest)
+        digest.update(b"}")
+    elif isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        digest.update(frame_digest(obj).encode("ascii"))
+    else:
+        digest.update(pickle.dumps(obj, protocol=4))
+
+
+def _digest(obj):
+    """Compute the digest of the canonical serialization of `obj`."""
+    digest = hashlib.sha1()
+    _update_digest(digest, obj)
+    return digest.digest()
+
+
+def _function_name_digest(func):
+    """Compute a short hex digest of the qualified name of `func`."""
+    name = "{}.{}".format(func.__module__, getattr(func, "__qualname__", ""))
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+
+
+def _function_digest(func, version=None):
+    """
+    Compute a hex digest identifying the version of `func`.
+
+    The digest covers either `version`, if given, or the function's
+    source code (its bytecode if the source is not available), so that
+    it changes whenever the function does.
+    """
+    digest = hashlib.sha1()
+    if version is not None:
+        _update_digest(digest, version)
+    else:
+        try:
+            digest.update(inspect.getsource(func).encode("utf-8"))
+        except (OSError, TypeError):
+            digest.update(func.__code__.co_code)
+    return digest.hexdigest()[:16]
+
+
+def _arguments_digest(args, kwargs):
+    """Compute a hex digest of a function's arguments."""
+    return _digest((args, kwargs)).hex()[:16]
+
+
+# the shape of the keys generated by `pandas_memoize`: digests of the
+# function's name, of its version and of the arguments
+_CACHE_KEY = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{16}-[0-9a-f]{16}$")
+
+
+def _cache_files(path, name_digest):
+    """
+    Find the existing cache files of a function for the keyed cache
+    file name `path`.
+
+    Only files whose key has exactly the shape generated for the
+    function with the name digest `name_digest` are considered, so
+    that other files matching `path` are never touched.
+
+    Returns a list of `(key, filename)` pairs.
+    """
+    prefix, suffix = path.split("{key}")
+    pattern = "{}*{}".format(
+        glob.escape(prefix + name_digest + "-"), glob.escape(suffix)
+    )
+    files = []
+    for filename in glob.glob(pattern):
+        key = filename[len(prefix):len(filename) - len(suffix)]
+        if _CACHE_KEY.match(key):
+            files.append((key, filename))
+    return files
+
+
+def _remove_cache(filename):
+    """
+    Delete the cache file `filename`.
+
+    Returns True if the cache file was deleted.
     """
+    try:
+        os.remove(filename)
+    except OSError:
+        return False
+    return True
+
+
+def _remove_stale_caches(path, name_digest, func_digest):
+    """Delete cache files written by other versions of the function."""
+    for key, filename in _cache_files(path, name_digest):
+        if key.split("-")[1] != func_digest:
+            _remove_cache(filename)
+
+
+def _evict_caches(path, name_digest, max_size, keep):
+    """
+    Delete least recently used cache files of a function until their
+    total size is at most `max_size` bytes, never deleting the file
+    `keep`.
+    """
+    files = []
+    for _key, filename in _cache_files(path, name_digest):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, filename))
+    total_size = sum(size for _mtime, size, _filename in files)
+    for _mtime, size, filename in sorted(files):
+        if total_size <= max_size:
+            break
+        if filename != keep and _remove_cache(filename):
+            total_size -= size
+
+
+def pandas_memoize(
+    path,
+    format=None,
+    memory_map=False,
+    version=None,
+    max_size=None,
+    lazy=False,
+    optimize_dtypes=False,
+    **kwds,
+):
+    """
+    Memoize the pandas DataFrame result of a function to a file.
+
+    The columnar formats (parquet and feather) preserve dtypes such as
+    categoricals, datetimes and nullable integers, and are much faster
+    to load than CSV; they need `pyarrow` (or `fastparquet` for
+    parquet).  An existing cache file is read in the format it was
+    actually written in, so legacy CSV caches keep working.
 
-    def pandas_memoize_csv_decorator(func):
+    If `path` contains the placeholder "{key}", one cache file is kept
+    per distinct set of arguments: the placeholder is replaced by
+    digests of the function's qualified name, of its source code (or
+    of `version`) and of the arguments.  Cache files left by other
+    versions of the function are deleted when a new file is written,
+    and if `max_size` is given, the function's least recently used
+    files are evicted to keep the total size of its cache files below
+    it.  Files which are not caches of the same function are never
+    touched, so the file name pattern can be shared.
+
+    Cache files are written atomically, and while the result is being
+    computed, a lock on the file `path` + ".lock" makes concurrent
+    callers (threads or processes) wait for it instead of computing
+    it again.  The lock file is deleted afterwards.
+
+    With `lazy`, the decorated function returns a `LazyFrame` handle
+    on the cache file instead of the DataFrame, from which chunks or
+    selected columns and rows can be loaded.
+
+    With `optimize_dtypes`, the DataFrame is passed through `compact`
+    before it is stored and after it is loaded, which also restores
+    compact dtypes from CSV caches.  (`LazyFrame` loads are not
+    compacted.)
+
+    :param str path: the cache file, possibly containing "{key}"
+    :param str format: one of "parquet", "feather", "pickle" or "csv".
+        By default, this is inferred from the extension of `path`,
+        falling back to "parquet".
+    :param bool memory_map: whether to memory-map the file on loading
+    :param version: optional, a value identifying the version of the
+        function to use instead of its source code
+    :param int max_size: optional, maximum total size in bytes of the
+        cache files of a keyed cache
+    :param bool lazy: whether to return a `LazyFrame` handle
+    :param bool optimize_dtypes: whether to `compact` the DataFrame
+    :param dict kwds: passed to the function reading the cache file
+    """
+    path = str(path)
+    if format is None:
+        format = _infer_format(path.replace("{key}", ""))
+    if format not in PANDAS_MEMOIZE_FORMATS:
+        raise ValueError("unknown format {!r}".format(format))
+    keyed = "{key}" in path
+    if keyed and path.count("{key}") > 1:
+        raise ValueError("path must contain at most one {key} placeholder")
+
+    def pandas_memoize_decorator(func):
+        if keyed:
+            name_digest = _function_name_digest(func)
+            func_digest = _function_digest(func, version)
+
+        def load_cache(cache_path):
+            fmt = _sniff_format(cache_path, format)
+            if lazy:
+                return LazyFrame(cache_path, fmt, memory_map, **kwds)
+            df = _read_frame(cache_path, fmt, memory_map, **kwds)
+            if optimize_dtypes:
+                df = compact(df)
+            return df
+
+        @functools.wraps(func)
         def func_wrapper(*args, **kwargs):
-            try:
-                retval = pd.read_csv(
-                    csv_filename, encoding="utf-8", index_col=0, **kwds
+            if keyed:
+                key = "-".join(
+                    [name_digest, func_digest, _arguments_digest(args, kwargs)]
                 )
+                cache_path = path.replace("{key}", key)
+            else:
+                cache_path = path
+            try:
+                retval = load_cache(cache_path)
             except IOError:
-                retval = func(*args, **kwargs)
-                retval.to_csv(csv_filename, encoding="utf-8")
+                # only one process computes the result; the others wait
+                # for it and then read the finished cache
+                with file_lock(cache_path + ".lock", remove=True):
+                    try:
+                        return load_cache(cache_path)
+                    except IOError:
+                        pass
+                    if keyed:
+                        _remove_stale_caches(path, name_digest, func_digest)
+                    retval = func(*args, **kwargs)
+                    if optimize_dtypes:
+                        retval = compact(retval)
+                    _write_frame(retval, cache_path, format)
+                    if keyed and max_size is not None:
+                        _evict_caches(
+                            path, name_digest, max_size, cache_path
+                        )
+                if lazy:
+                    retval = LazyFrame(cache_path, format, memory_map, **kwds)
+            else:
+                if keyed:
+                    # record the access for least-recently-used eviction
+                    os.utime(cache_path)
             return retval
 
         return func_wrapper
 
-    return pandas_memoize_csv_decorator
+    return pandas_memoize_decorator
+
+
+def pandas_memoize_csv(csv_filename, **kwds):
+    """
+    Memoize the pandas DataFrame result of a function to a CSV file.
+
+    :param str csv_filename:
+    :param dict kwds: passed to the pd.read_csv function
+    """
+    return pandas_memoize(csv_filename, format="csv", **kwds)
 
 
 # based on
@@ -56,12 +759,254 @@ def flatten_dict(dictionary, parent_key=False, separator="."):
             items.extend(flatten_dict(value, new_key, separator).items())
         elif isinstance(value, list):
             for k, v in enumerate(value):
-                items.extend(flatten_dict({str(k): v}, new_key).items())
+                items.extend(
+                    flatten_dict({str(k): v}, new_key, separator).items()
+                )
         else:
             items.append((new_key, value))
     return dict(items)
 
 
+_OPEN = object()
+_CLOSE = object()
+_SCALAR_TYPES = (str, int, float, type(None))
+
+
+def _walk_record(record):
+    """
+    Walk the nested dictionary `record` iteratively.
+
+    Returns a signature, a tuple describing the structure of `record`
+    (its keys, list indices and nesting), and the list of its leaf
+    values, in the order in which `flatten_dict` would produce them.
+    """
+    signature = []
+    values = []
+    # local names for speed: this runs once per leaf of every record
+    add_token = signature.append
+    add_value = values.append
+    stack = [iter(record.items())]
+    push = stack.append
+    while stack:
+        for key, value in stack[-1]:
+            add_token(key)
+            if isinstance(value, _SCALAR_TYPES):
+                add_value(value)
+            elif isinstance(value, list):
+                add_token(_OPEN)
+                push(iter(enumerate(value)))
+                break
+            elif isinstance(value, collections.abc.MutableMapping):
+                add_token(_OPEN)
+                push(iter(value.items()))
+                break
+            else:
+                add_value(value)
+        else:
+            stack.pop()
+            add_token(_CLOSE)
+    return tuple(signature), values
+
+
+def _signature_columns(signature, separator):
+    """Compute the flattened column names of the leaves of a signature."""
+    columns = []
+    prefixes = [""]
+    key = None
+    for token in signature:
+        if token is _OPEN:
+            prefixes.append(prefixes[-1] + str(key) + separator)
+            key = None
+            continue
+        if key is not None:
+            columns.append(prefixes[-1] + str(key))
+            key = None
+        if token is _CLOSE:
+            prefixes.pop()
+        else:
+            key = token
+    return columns
+
+
+def _flatten_record_chunks(records, separator, chunksize):
+    """
+    Flatten `records` into dictionaries of column lists.
+
+    Yields `(start, data)` pairs, where `start` is the index of the
+    first record in the chunk.  Every chunk has all the columns seen
+    so far, in order of their first appearance.
+    """
+    schema = {}
+    signature_columns = {}
+    records = iter(records)
+    start = 0
+    while True:
+        # group the records of the chunk by their structure
+        groups = {}
+        num_rows = 0
+        chunk = itertools.islice(records, chunksize)
+        for num_rows, record in enumerate(chunk, 1):
+            signature, values = _walk_record(record)
+            group = groups.get(signature)
+            if group is None:
+                group = groups[signature] = ([], [])
+                if signature not in signature_columns:
+                    columns = _signature_columns(signature, separator)
+                    signature_columns[signature] = columns
+                    schema.update(dict.fromkeys(columns))
+            group[0].append(num_rows - 1)
+            group[1].append(values)
+        if num_rows == 0 and (start > 0 or chunksize is not None):
+            return
+        # then transpose each group into the columns
+        data = {}
+        for signature, (rows, values) in groups.items():
+            columns = signature_columns[signature]
+            if len(rows) == num_rows:
+                data.update(zip(columns, map(list, zip(*values))))
+                continue
+            for column, column_values in zip(columns, zip(*values)):
+                target = data.get(column)
+                if target is None:
+                    target = data[column] = [None] * num_rows
+                for row, value in zip(rows, column_values):
+                    target[row] = value
+        yield start, {
+            column: data[column] if column in data else [None] * num_rows
+            for column in schema
+        }
+        if chunksize is None or num_rows < chunksize:
+            return
+        start += num_rows
+
+
+def flatten_records(records, separator=".", chunksize=None, output="dict"):
+    """
+    Flatten a stream of nested dictionaries into columns.
+
+    Produces the same columns as calling `flatten_dict` on each record,
+    but the column names are only computed once for each distinct
+    structure of the records, and the values are appended straight to
+    the column lists.  Records without some column get None there.
+
+    :param iterable records: the nested dictionaries
+    :param str separator: the string used to separate flattened keys
+    :param int chunksize: optional; if given, a generator of chunks of
+        at most this many records is returned.  All chunks have the
+        columns seen so far, so that later chunks may add columns.
+    :param str output: "dict" for a dictionary of column lists,
+        "pandas" for a DataFrame, or "arrow" for a `pyarrow.Table`
+    """
+    if output not in ("dict", "pandas", "arrow"):
+        raise ValueError("unknown output {!r}".format(output))
+    if output == "arrow" and pa is None:
+        raise ImportError("pyarrow is required for arrow output")
+
+    def convert(start, data):
+        if output == "pandas":
+            num_rows = len(next(iter(data.values()), ()))
+            return pd.DataFrame(
+                data, index=pd.RangeIndex(start, start + num_rows),
+                columns=list(data),
+            )
+        if output == "arrow":
+            return pa.Table.from_pydict(data)
+        return data
+
+    chunks = _flatten_record_chunks(records, separator, chunksize)
+    if chunksize is None:
+        return convert(*next(chunks))
+    return (convert(start, data) for start, data in chunks)
+
+
+_JSONL_BATCH_SIZE = 10000
+
+
+def _binary_lines(path):
+    """
+    Yield the lines of the file `path` as bytes.
+
+    Unlike decoded text streams, this only splits lines at newline
+    bytes, and not at other Unicode line boundaries such as U+2028,
+    which may occur unescaped inside JSON strings.
+    """
+    with open_file(path, "rb") as input_file:
+        for line in input_file:
+            yield line
+
+
+def _parse_jsonl_batch(batch, flatten=True, separator=".", encoding="utf-8"):
+    """Parse a batch of JSON lines, given as bytes, into a DataFrame."""
+    records = [
+        json.loads(line.decode(encoding)) for line in batch if line.strip()
+    ]
+    if flatten:
+        return flatten_records(records, separator=separator, output="pandas")
+    return pd.DataFrame(records)
+
+
+def _align_frames(frames):
+    """
+    Give successive DataFrames the columns seen so far, and a
+    continuous index.
+    """
+    schema = {}
+    start = 0
+    for df in frames:
+        schema.update(dict.fromkeys(df.columns))
+        df = df.reindex(columns=list(schema))
+        df.index = pd.RangeIndex(start, start + len(df))
+        start += len(df)
+        yield df
+
+
+def read_jsonl(
+    path, flatten=True, chunksize=None, separator=".", workers=None,
+    encoding="utf-8",
+):
+    """
+    Read a JSON Lines file into DataFrames.
+
+    The file is read with `wkr.io.open_file`, so it may be compressed,
+    and is split into lines at newline characters only.
+    Each record is flattened into the column names that
+    `flatten_dict` produces with the same `separator`, including the
+    indices of list items.  Blank lines are skipped.
+
+    :param str path: the file to read
+    :param bool flatten: whether to flatten nested records into
+        columns; otherwise, only the top-level keys become columns
+    :param int chunksize: optional; if given, return a generator of
+        DataFrames of at most this many rows.  Every chunk has all the
+        columns seen so far, in order of their first appearance, and
+        the index continues from chunk to chunk.
+    :param str separator: the string used to separate flattened keys
+    :param int workers: optional; if given, batches of lines are
+        parsed in this many worker processes
+    :param str encoding: the encoding of the file
+    :return: a DataFrame, or a generator of DataFrames
+    """
+    parse = functools.partial(
+        _parse_jsonl_batch,
+        flatten=flatten,
+        separator=separator,
+        encoding=encoding,
+    )
+    batches = chunks(_binary_lines(path), chunksize or _JSONL_BATCH_SIZE)
+    if workers is None:
+        frames = map(parse, batches)
+    else:
+        frames = parallel_map(
+            parse, batches, workers=workers, chunk_size=1, backend="process"
+        )
+    if chunksize is not None:
+        return _align_frames(frames)
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
 class AutoExpandingDict(collections.defaultdict):
     def __init__(self, /, *args, **kwargs):
         super().__init__(self.__class__, *args, **kwargs)
@@ -80,17 +1025,102 @@ def _intkeys_to_lists(dictionary):
         return result
 
 
-def unflatten_dict(dictionary, separator=".", intkeys_to_lists=True):
-    result = AutoExpandingDict()
+def _unflatten_plain(dictionary, separator, intkeys_to_lists):
+    """
+    Unflatten `dictionary` directly, without compiling its keys.
+
+    Builds the nested dictionaries in a single pass over the keys, and
+    then turns those keyed by 0, 1, 2, ... into lists, children
+    before their parents.
+    """
+    make_dict = dict if intkeys_to_lists else AutoExpandingDict
+    root = make_dict()
+    # the containers built here, as opposed to dictionary values
+    created = {id(root)}
+    containers = []
     for key, value in dictionary.items():
         path = key.split(separator)
-        ptr = result
+        node = root
         for part in path[:-1]:
-            ptr = ptr[part]
-        ptr[path[-1]] = value
-    if intkeys_to_lists:
-        result = _intkeys_to_lists(result)
-    return result
+            if part in node:
+                child = node[part]
+                if id(child) not in created:
+                    raise TypeError(
+                        "key {!r} is both a value and a dictionary"
+                        .format(part)
+                    )
+            else:
+                child = node[part] = make_dict()
+                created.add(id(child))
+                containers.append((node, part, child))
+            node = child
+        if path[-1] in node and id(node[path[-1]]) in created:
+            raise TypeError(
+                "key {!r} is both a value and a dictionary".format(path[-1])
+            )
+        node[path[-1]] = value
+    if not intkeys_to_lists:
+        return root
+    for parent, part, node in reversed(containers):
+        if _is_list_node(node):
+            parent[part] = [node[str(idx)] for idx in range(len(node))]
+    if _is_list_node(root):
+        return [root[str(idx)] for idx in range(len(root))]
+    return root
+
+
+_UNFLATTEN_CACHE_SIZE = 256
+# maps (keys, separator, intkeys_to_lists) to a compiled builder, or
+# to None for keys seen only once; ordered from least recently used
+_UNFLATTEN_BUILDERS = {}
+
+
+def _unflatten_builder(keys, separator, intkeys_to_lists):
+    """
+    Find the compiled record builder for a tuple of flattened keys.
+
+    Compiling only pays off for keys which repeat, so None is returned
+    the first time a tuple of keys is seen, and the builder is only
+    compiled when it is seen again.
+    """
+    cache_key = (keys, separator, intkeys_to_lists)
+    builder = _UNFLATTEN_BUILDERS.pop(cache_key, False)
+    if builder is None:
+        paths = tuple(tuple(key.split(separator)) for key in keys)
+        builder = _compile_unflatten(paths, intkeys_to_lists)
+    elif builder is False:
+        builder = None
+    _UNFLATTEN_BUILDERS[cache_key] = builder
+    if len(_UNFLATTEN_BUILDERS) > _UNFLATTEN_CACHE_SIZE:
+        try:
+            del _UNFLATTEN_BUILDERS[next(iter(_UNFLATTEN_BUILDERS))]
+        except (KeyError, RuntimeError, StopIteration):
+            # another thread changed the cache meanwhile
+            pass
+    return builder
+
+
+def unflatten_dict(dictionary, separator=".", intkeys_to_lists=True):
+    """
+    Turn a flattened dictionary into a nested dictionary.
+
+    The inverse of `flatten_dict`.  When dictionaries with the same
+    sequence of keys are unflattened repeatedly, the nesting of the
+    keys is only worked out once, which makes this much faster;
+    dictionaries with keys not seen recently are unflattened
+    directly.
+
+    :param dict dictionary: the flattened dictionary
+    :param str separator: the string used to separate flattened keys
+    :param bool intkeys_to_lists: whether to turn dictionaries keyed
+        by 0, 1, 2, ... into lists; otherwise, the result is made of
+        `AutoExpandingDict` objects
+    :raises TypeError: if a key is both a value and a dictionary
+    """
+    build = _unflatten_builder(tuple(dictionary), separator, intkeys_to_lists)
+    if build is None:
+        return _unflatten_plain(dictionary, separator, intkeys_to_lists)
+    return build(tuple(dictionary.values()))
 
 
 def unflatten_pd_row(row, prefix="", separator=".", intkeys_to_lists=True):
@@ -105,3 +1135,163 @@ def unflatten_pd_row(row, prefix="", separator=".", intkeys_to_lists=True):
     if intkeys_to_lists:
         result = _intkeys_to_lists(result)
     return result
+
+
+def _compile_paths(paths):
+    """
+    Build the tree of the nested keys `paths`.
+
+    The tree is a dictionary mapping keys to subtrees or, at the
+    leaves, to the position of the path in `paths`.
+    """
+    root = {}
+    for position, path in enumerate(paths):
+        node = root
+        for part in path[:-1]:
+            child = node.setdefault(part, {})
+            if not isinstance(child, dict):
+                raise TypeError(
+                    "key {!r} is both a value and a dictionary".format(part)
+                )
+            node = child
+        if isinstance(node.get(path[-1]), dict):
+            raise TypeError(
+                "key {!r} is both a value and a dictionary".format(path[-1])
+            )
+        node[path[-1]] = position
+    return root
+
+
+def _is_list_node(node):
+    """Check if the keys of a tree node are the indices of a list."""
+    return all(key.isdigit() for key in node) and set(node) == {
+        str(idx) for idx in range(len(node))
+    }
+
+
+def _compile_plan(tree, intkeys_to_lists):
+    """
+    Compile the tree of nested keys into a plan building a record.
+
+    The plan lists one step per container of the record, children
+    before their parents.  Each step is a tuple `(make, keys, sources,
+    num_children)`: `make` builds the container from `keys` and the
+    items (`keys` is None for lists), and `sources` gives, for each
+    item, either the position of its value or None for a container
+    built by an earlier step; the last `num_children` containers built
+    are those of this step.  The tree is traversed iteratively, so
+    there is no limit on the nesting depth.
+    """
+    make_dict = dict if intkeys_to_lists else AutoExpandingDict
+    plan = []
+    # nodes still to be visited have no step yet
+    stack = [(tree, None)]
+    while stack:
+        node, step = stack.pop()
+        if step is None:
+            if intkeys_to_lists and _is_list_node(node):
+                make, keys = None, None
+                children = [node[str(idx)] for idx in range(len(node))]
+            else:
+                make, keys = make_dict, tuple(node)
+                children = list(node.values())
+            # push the child containers so that they are built in the
+            # order of the items of the step, whatever the key order
+            stack.append((node, (make, keys, children)))
+            stack.extend(
+                (child, None)
+                for child in reversed(children)
+                if isinstance(child, dict)
+            )
+            continue
+        make, keys, children = step
+        sources = tuple(
+            None if isinstance(child, dict) else child for child in children
+        )
+        num_children = sum(source is None for source in sources)
+        plan.append((make, keys, sources, num_children))
+    return plan
+
+
+def _run_plan(plan, values):
+    """Build a nested record from a tuple of `values` following `plan`."""
+    built = []
+    for make, keys, sources, num_children in plan:
+        if num_children:
+            children = iter(built[-num_children:])
+            del built[-num_children:]
+            items = [
+                next(children) if source is None else values[source]
+                for source in sources
+            ]
+        else:
+            items = [values[source] for source in sources]
+        built.append(items if make is None else make(zip(keys, items)))
+    return built[-1]
+
+
+def _compile_unflatten(paths, intkeys_to_lists=True):
+    """
+    Compile a function building a nested record from a tuple of values.
+
+    The values correspond to the nested keys `paths`, each a tuple of
+    strings.  The structure of the record, including the decision
+    whether a level becomes a list, is worked out once here, so that
+    building each record only allocates its containers.
+    """
+    if () in paths:
+        if len(paths) > 1:
+            raise TypeError("a value is also the root of the record")
+        return operator.itemgetter(0)
+    plan = _compile_plan(_compile_paths(paths), intkeys_to_lists)
+    return functools.partial(_run_plan, plan)
+
+
+_UNFLATTEN_CHUNK_SIZE = 10000
+
+
+def unflatten_dataframe(
+    df, prefix="", separator=".", intkeys_to_lists=True, iterator=False
+):
+    """
+    Turn the rows of a DataFrame with flattened columns into nested records.
+
+    This is the bulk equivalent of calling `unflatten_pd_row` on every
+    row: the nesting of the columns is worked out only once, and the
+    records are built straight from the column values.
+
+    :param pd.DataFrame df: the DataFrame
+    :param str prefix: optional, only unflatten the columns nested
+        under this key, and return the values under it
+    :param str separator: the string used to separate flattened keys
+    :param bool intkeys_to_lists: whether to turn dictionaries keyed
+        by 0, 1, 2, ... into lists
+    :param bool iterator: if True, return a generator which builds
+        the records a chunk of rows at a time, to limit memory use
+    :return: a list (or generator) of the records
+    """
+    prefix_path = tuple(prefix.split(separator)) if prefix else ()
+    positions = []
+    paths = []
+    for position, column in enumerate(df.columns):
+        path = tuple(str(column).split(separator))
+        if path[:len(prefix_path)] == prefix_path:
+            positions.append(position)
+            paths.append(path[len(prefix_path):])
+    build = _compile_unflatten(tuple(paths), intkeys_to_lists)
+
+    def records(start, stop):
+        if not positions:
+            return map(build, itertools.repeat((), stop - start))
+        columns = [
+            df.iloc[start:stop, position].tolist() for position in positions
+        ]
+        return map(build, zip(*columns))
+
+    if not iterator:
+        return list(records(0, len(df)))
+    return (
+        record
+        for start in range(0, len(df), _UNFLATTEN_CHUNK_SIZE)
+        for record in records(start, start + _UNFLATTEN_CHUNK_SIZE)
+    )